@@ -0,0 +1,425 @@
+# Description : Offline benchmarks of the download, scan and generation paths of main.py,
+#               run against a local HTTP stand-in serving synthetic installers.
+
+
+import os
+import sys
+import io
+import json
+import argparse
+import contextlib
+import hashlib
+import platform
+import random
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import main
+
+# Catalog sizes the scan and render benchmarks run with by default
+DEFAULT_CATALOG_SIZES = [10, 100, 1000, 10000]
+
+# Realistic installer sizes in MB, scaled down with --size-scale for quick runs
+INSTALLER_SIZES_MB = {
+    "VsCodeSetup-x64.exe": 98,
+    "SysinternalsSuite.zip": 50,
+    "python-3.12.4-amd64.exe": 26,
+    "python-2.7.18.amd64.msi": 19,
+    "JPEGView_1.3.46.7z": 6,
+    "Git-2.50.0-64-bit.exe": 66,
+    "windowsdesktop-runtime-9.0.7-win-x64.exe": 58,
+    "Get-ZimmermanTools.zip": 1,
+}
+
+# Size of 7-Zip, which every download run fetches as well
+SEVEN_ZIP_SIZE_MB = 1.5
+
+# Block the synthetic installers repeat, so nothing has to be kept in memory or on disk per file
+PATTERN = random.Random(0).randbytes(1024 * 1024)
+
+
+class StandInServer:
+    """Local HTTP server serving synthetic installers with injected latency, bandwidth limit and failures.
+
+    Each file is served under /<name> with HEAD, Range/If-Range and a strong ETag, like the
+    download hosts main.py talks to. A failed request either answers 503 or drops the
+    connection halfway through the body."""
+
+    def __init__(self, files: dict, latency: float = 0.0, bandwidth: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.files = files
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.failure_rate
+            self.failures += failed
+            return failed
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.serve(send_body=False)
+
+            def do_GET(self):
+                self.serve(send_body=True)
+
+            def serve(self, send_body: bool):
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                name = self.path.lstrip('/')
+                if name not in stand_in.files:
+                    self.send_error(404)
+                    return
+                fail = send_body and stand_in._fail()
+                if fail and stand_in.random.random() < 0.5:
+                    self.send_error(503, "Injected failure")
+                    return
+
+                size = stand_in.files[name]
+                etag = f'"{name}-{size}"'
+                start, end = 0, size - 1
+                ranged = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if ranged and self.headers.get('If-Range', etag) == etag:
+                    start = int(ranged.group(1))
+                    end = min(int(ranged.group(2)), size - 1) if ranged.group(2) else size - 1
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('ETag', etag)
+                self.end_headers()
+                if send_body:
+                    self.send_body(start, end + 1 - start, drop_after=(end + 1 - start) // 2 if fail else None)
+
+            def send_body(self, offset: int, length: int, drop_after: int = None):
+                sent = 0
+                began = time.monotonic()
+                block_size = len(PATTERN)
+                while sent < length:
+                    if drop_after is not None and sent >= drop_after:
+                        self.close_connection = True
+                        return
+                    position = (offset + sent) % block_size
+                    chunk = PATTERN[position:position + min(length - sent, 64 * 1024)]
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if stand_in.bandwidth:
+                        # Sleep until the connection is back under its bandwidth
+                        delay = sent / stand_in.bandwidth - (time.monotonic() - began)
+                        if delay > 0:
+                            time.sleep(delay)
+
+        return Handler
+
+
+def served_sha256(size: int) -> str:
+    """Return the SHA-256 of the synthetic installer of a given size, as the stand-in serves it."""
+    digest = hashlib.sha256()
+    for offset in range(0, size, len(PATTERN)):
+        digest.update(PATTERN[:min(len(PATTERN), size - offset)])
+    return digest.hexdigest()
+
+def _measure(function, repeat: int) -> dict:
+    """Run a function repeat times with its output silenced and summarize the timings in seconds."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - start)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'runs': len(timings),
+        'result': result,
+    }
+
+def _reset_state(workdir: str):
+    """Point main.py at a scratch folder and drop everything it cached in memory."""
+    main.SETUPS_DIR = os.path.join(workdir, 'setups')
+    main.CONFIG_PATH = os.path.join(workdir, 'config.json')
+    main._config = None
+    main._config_dirty.clear()
+    main._dependency_graphs.clear()
+    main._install_recipes.clear()
+    main._manifests.clear()
+
+def synthetic_catalog(size: int, base_url: str = 'http://127.0.0.1:9', seed: int = 0) -> dict:
+    """Build a configuration with size enabled tools covering every recipe type and some dependencies."""
+    rng = random.Random(seed)
+    kinds = [
+        ('exe', '.exe', {'type': 'exe', 'args': '/S', 'path': ['C:\\Program Files\\Tool\\bin']}),
+        ('msi', '.msi', {'type': 'msi'}),
+        ('archive', '.zip', None),
+        ('pip', None, None),
+    ]
+    tools = {}
+    names = []
+    for index in range(size):
+        kind, extension, recipe = kinds[index % len(kinds)]
+        tool_name = f"Tool {index:05d}"
+        filename = f"tool-{index:05d}{extension}" if extension else "None"
+        if kind == 'archive':
+            recipe = {'type': 'archive', 'target': f'C:\\Users\\WDAGUtilityAccount\\Desktop\\Tools\\tool-{index:05d}'}
+        elif kind == 'pip':
+            recipe = {'type': 'pip', 'packages': [f'package-{index}']}
+        tool = {
+            'link': f'{base_url}/{filename}',
+            'Description': f'Synthetic tool {index}.',
+            'version': '1.0',
+            'enable': True,
+            'name': filename,
+            'install': recipe,
+        }
+        # Roughly a third of the tools depend on one or two earlier ones
+        if names and rng.random() < 0.33:
+            tool['dependencies'] = rng.sample(names, min(len(names), rng.randint(1, 2)))
+        tools[tool_name] = tool
+        names.append(tool_name)
+    return {
+        'tools': tools,
+        'vmConfig': {
+            'vGPU': 'Default',
+            'Networking': 'Default',
+            'MemoryInMB': '4GB',
+            'LogonCommand': 'C:\\Users\\WDAGUtilityAccount\\Desktop\\scripts\\start.cmd',
+            'MappedFolder': [],
+        },
+    }
+
+def bench_download(args: argparse.Namespace, workdir: str) -> list:
+    """Measure download_missing_setup_files throughput against the stand-in, from an empty store each run.
+
+    The segment threshold is lowered to 1 MB so scaled-down installers still take the segmented
+    path, and every download is only counted as succeeded when its SHA-256 matches the served bytes."""
+    files = {name: max(1, int(size * args.size_scale * 1024 * 1024)) for name, size in INSTALLER_SIZES_MB.items()}
+    files[main.SEVEN_ZIP_NAME] = max(1, int(SEVEN_ZIP_SIZE_MB * args.size_scale * 1024 * 1024))
+    results = []
+    with StandInServer(files, args.latency_ms / 1000, args.bandwidth_mbps * 1024 * 1024 / 8, args.failure_rate) as server:
+        seven_zip_link = main.SEVEN_ZIP_LINK
+        main.SEVEN_ZIP_LINK = f"{server.url}/{main.SEVEN_ZIP_NAME}"
+        try:
+            config = {
+                'tools': {
+                    name: {'link': f'{server.url}/{name}', 'name': name, 'version': '1.0', 'enable': True}
+                    for name in INSTALLER_SIZES_MB
+                },
+                'vmConfig': {},
+                'downloadConfig': {'segmentThresholdMB': 1},
+                'cacheConfig': {'path': os.path.join(workdir, 'cache'), 'maxSizeMB': 1024 * 1024},
+                'telemetryConfig': {'metricsFile': os.path.join(workdir, 'metrics.jsonl')},
+            }
+
+            def run():
+                shutil.rmtree(os.path.join(workdir, 'cache'), ignore_errors=True)
+                shutil.rmtree(os.path.join(workdir, 'setups'), ignore_errors=True)
+                _reset_state(workdir)
+                return main.download_missing_setup_files(config)
+
+            measured = _measure(run, args.repeat)
+        finally:
+            main.SEVEN_ZIP_LINK = seven_zip_link
+        downloads = measured.pop('result')
+        expected = {name: served_sha256(size) for name, size in files.items()}
+        corrupted = [download['name'] for download in downloads if download['ok'] and download['sha256'] != expected[download['name']]]
+        if corrupted:
+            print(f"[-] SHA-256 mismatch against the served bytes: {', '.join(corrupted)}", file=sys.stderr)
+        total_bytes = sum(files.values())
+        results.append({
+            'files': len(files),
+            'bytes': total_bytes,
+            'succeeded': sum(1 for download in downloads if download['ok'] and download['name'] not in corrupted),
+            'corrupted': corrupted,
+            'seconds': measured,
+            'throughputMBps': total_bytes / measured['median'] / (1024 * 1024),
+            'requests': server.requests,
+            'injectedFailures': server.failures,
+        })
+    return results
+
+def bench_scan(args: argparse.Namespace, workdir: str) -> list:
+    """Measure get_missing_setup_files for every catalog size, with the store full and with it empty."""
+    results = []
+    for size in args.sizes:
+        config = synthetic_catalog(size)
+        config['cacheConfig'] = {'path': os.path.join(workdir, f'scan-{size}')}
+        _reset_state(workdir)
+        present = _measure(lambda: len(main.get_missing_setup_files(config)), args.repeat)
+
+        # Fill the store as if every installer had been downloaded, with a tiny object file each
+        cache_dir = main.get_cache_dir(config)
+        manifest = main.load_manifest(cache_dir)
+        for tool in config['tools'].values():
+            digest = hashlib.sha256(tool['name'].encode()).hexdigest()
+            object_path = main._object_path(cache_dir, digest)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            with open(object_path, 'wb') as file:
+                file.write(tool['name'].encode())
+            size = len(tool['name'])
+            manifest['objects'][digest] = {'size': size, 'lastUsed': 0}
+            manifest['entries'][tool['name']] = {'url': tool['link'], 'sha256': digest, 'size': size, 'lastUsed': 0}
+        stored = _measure(lambda: len(main.get_missing_setup_files(config)), args.repeat)
+        results.append({
+            'tools': size,
+            'missing': {'seconds': present, 'found': present.pop('result')},
+            'stored': {'seconds': stored, 'found': stored.pop('result')},
+        })
+    return results
+
+def bench_render(args: argparse.Namespace, workdir: str) -> list:
+    """Measure generate_setup_cmd and generate_wsb_config for every catalog size, cold and when unchanged."""
+    results = []
+    for size in args.sizes:
+        config = synthetic_catalog(size)
+        config['cacheConfig'] = {'path': os.path.join(workdir, f'render-{size}')}
+        setup_path = os.path.join(workdir, f'setup-{size}.cmd')
+        wsb_path = os.path.join(workdir, f'sandbox-{size}.wsb')
+        entry = {'tools': size}
+        for name, generate, path in (
+            ('setupCmd', lambda path: main.generate_setup_cmd(config, output_path=path), setup_path),
+            ('wsb', lambda path: main.generate_wsb_config(config, output_path=path), wsb_path),
+        ):
+            def cold():
+                # No cached graph or recipes and no output on disk: everything is built and written
+                _reset_state(workdir)
+                if os.path.exists(path):
+                    os.remove(path)
+                return generate(path)
+
+            entry[name] = {
+                'cold': _measure(cold, args.repeat),
+                'unchanged': _measure(lambda: generate(path), args.repeat),
+                'bytes': os.path.getsize(path),
+            }
+            entry[name]['cold'].pop('result')
+            entry[name]['unchanged'].pop('result')
+        results.append(entry)
+    return results
+
+def _metrics(report: dict, prefix: str = '') -> dict:
+    """Flatten the median timings of a report into {metric path: seconds}."""
+    metrics = {}
+    for key, value in report.items():
+        if isinstance(value, dict) and 'median' in value:
+            metrics[prefix + key] = value['median']
+        elif isinstance(value, dict):
+            metrics.update(_metrics(value, f'{prefix}{key}.'))
+        elif isinstance(value, list):
+            for item in value:
+                label = item.get('tools', item.get('files'))
+                metrics.update(_metrics(item, f'{prefix}{key}[{label}].'))
+    return metrics
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """List the timings that got slower than the baseline by more than tolerance (0.2 = 20%)."""
+    current = _metrics(report['results'])
+    previous = _metrics(baseline['results'])
+    regressions = []
+    for metric, seconds in sorted(current.items()):
+        before = previous.get(metric)
+        if before and seconds > before * (1 + tolerance):
+            regressions.append({'metric': metric, 'baseline': before, 'current': seconds, 'ratio': seconds / before})
+    return regressions
+
+def main_benchmark(argv: list = None):
+    """Run the requested benchmarks and write their results as JSON."""
+    parser = argparse.ArgumentParser(description="Offline benchmarks of main.py against a local HTTP stand-in.")
+    parser.add_argument('--only', default='download,scan,render', help="comma separated benchmarks to run (default: all)")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_CATALOG_SIZES)), help="catalog sizes for scan and render")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the median is compared")
+    parser.add_argument('--size-scale', type=float, default=0.1, help="scale of the synthetic installer sizes (1 = realistic)")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="latency added to every request of the stand-in")
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0, help="bandwidth limit per connection in Mbit/s (0 = unlimited)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="share of downloads answered 503 or cut halfway")
+    parser.add_argument('--output', help="JSON file to write the results to (default: stdout)")
+    parser.add_argument('--baseline', help="earlier JSON results to compare against, exits with 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown allowed against the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    selected = [name.strip() for name in args.only.split(',') if name.strip()]
+    benchmarks = {'download': bench_download, 'scan': bench_scan, 'render': bench_render}
+    unknown = [name for name in selected if name not in benchmarks]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': {},
+    }
+    workdir = tempfile.mkdtemp(prefix='sandbox-bench-')
+    try:
+        for name in selected:
+            print(f"[*] Running the {name} benchmark...", file=sys.stderr)
+            os.makedirs(os.path.join(workdir, name))
+            report['results'][name] = benchmarks[name](args, os.path.join(workdir, name))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+        print(f"[+] Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"[-] {regression['metric']}: {regression['baseline']:.4f}s -> {regression['current']:.4f}s "
+                  f"({regression['ratio']:.2f}x)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"[+] No regression over {args.tolerance:.0%} against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -2,132 +2,1967 @@
 # Date   : 2025-06-26
 # Description : This script sets up a Windows environment with various tools and configurations.
 
+from __future__ import annotations
 
 import os
-import requests
 import sys
 import json
+import argparse
+import collections
+import contextlib
+import copy
+import re
+import hashlib
+import heapq
+import math
+import queue
+import random
+import shutil
+import subprocess
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse, quote, unquote
+
+if TYPE_CHECKING:
+    # Only imported when a download actually happens
+    import requests
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+SETUPS_DIR = os.path.join(os.path.dirname(__file__), 'scripts', 'setups')
+
+SEVEN_ZIP_NAME = '7z2409-x64.msi'
+SEVEN_ZIP_LINK = 'https://www.7-zip.org/a/7z2409-x64.msi'
+SEVEN_ZIP_VERSION = '24.09'
+# Name of the 7-Zip install step in the generated setup.cmd
+SEVEN_ZIP_STEP = '7-Zip'
+
+# How many times an install step retries while another MSI transaction is running
+MSI_BUSY_RETRIES = 60
+
+# Defaults for the optional "downloadConfig" section of config.json
+DEFAULT_DOWNLOAD_CONFIG = {
+    "maxWorkers": 6,
+    "maxPerHost": 2,
+    "segments": 4,
+    "segmentThresholdMB": 32,
+    "mirrors": [],
+    "probeTimeout": 2,
+    "retries": 4,
+    "backoffSeconds": 1,
+    "maxBackoffSeconds": 60,
+    "connectTimeout": 10,
+    "readTimeout": 30,
+}
+
+# HTTP statuses worth retrying a download on, everything else in the 4xx range is final
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Port the serve-cache command listens on by default
+SERVE_CACHE_PORT = 8765
+
+# How many bytes a download writes between two saves of its resume state
+STATE_SAVE_INTERVAL = 4 * 1024 * 1024
+
+# Size and count of the reusable buffers every download streams through
+STREAM_BUFFER_SIZE = 1024 * 1024
+STREAM_BUFFERS = 4
+
+# Defaults for the optional "cacheConfig" section of config.json
+DEFAULT_CACHE_CONFIG = {
+    "path": "cache",
+    "maxSizeMB": 20480,
+    "preExtract": False,
+}
+
+# Sandbox folder archives without an explicit install target are extracted to
+DEFAULT_ARCHIVE_FOLDER = "C:\\Users\\WDAGUtilityAccount\\Desktop\\Tools"
+
+# Folder of scripts/setups holding the offline wheelhouses of pip tools, and the interpreter they target by default
+WHEELHOUSE_FOLDER = "wheels"
+DEFAULT_WHEEL_PYTHON = "3.12"
+DEFAULT_WHEEL_PLATFORM = "win_amd64"
+
+# Defaults for the optional "profilingConfig" section of config.json
+DEFAULT_PROFILING_CONFIG = {
+    "enable": False,
+    "logDir": "logs",
+}
+
+# Defaults for the optional "telemetryConfig" section of config.json, an empty path disables that output
+DEFAULT_TELEMETRY_CONFIG = {
+    "metricsFile": "logs/metrics.jsonl",
+    "prometheusFile": "",
+}
+
+# Sandbox folder a named profile's setup.cmd and start.cmd are mapped to
+PROFILE_SANDBOX_FOLDER = "C:\\Users\\WDAGUtilityAccount\\Desktop\\profile"
+
+# Writable folder the instrumented setup.cmd logs its boot timings to
+BOOT_LOG_SANDBOX_FOLDER = "C:\\Users\\WDAGUtilityAccount\\Desktop\\bootlogs"
+
+# Version of the WinSandbox.wsb and setup.cmd generators, part of their fingerprint.
+# Bump it whenever a change to the generators changes what they write.
+GENERATOR_VERSION = 1
+
+# Marker recorded at the top of WinSandbox.wsb and setup.cmd with the fingerprint of their inputs
+FINGERPRINT_PATTERN = re.compile(r'sandbox-auto-setup fingerprint ([0-9a-f]{64})')
+
+_config = None
+_config_dirty = {}
+_dependency_graphs = {}
+_install_recipes = {}
+_manifests = {}
+_session = None
+_session_lock = threading.Lock()
+
+# Level of the '[+]' messages, between INFO and WARNING
+SUCCESS = 25
+LOG_LEVELS = {
+    logging.DEBUG: ('[*]', 'debug'),
+    logging.INFO: ('[*]', 'info'),
+    SUCCESS: ('[+]', 'success'),
+    logging.WARNING: ('[!]', 'warning'),
+    logging.ERROR: ('[-]', 'error'),
+}
+
+logger = logging.getLogger('sandbox-auto-setup')
+
+class _StdoutHandler(logging.StreamHandler):
+    """Stream handler writing to whatever sys.stdout is when a record is emitted."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+class _TextFormatter(logging.Formatter):
+    """Format records the way this script always printed them: '[+] message'."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return f"{LOG_LEVELS.get(record.levelno, ('[*]',))[0]} {record.getMessage()}"
+
+class _JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with their structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': LOG_LEVELS.get(record.levelno, (None, record.levelname.lower()))[1],
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+def configure_logging(quiet: bool = False, verbose: bool = False, json_format: bool = False):
+    """Send log messages to stdout as '[x]' lines or JSON objects.
+
+    quiet keeps only warnings and errors, verbose adds the per-tool details."""
+    handler = _StdoutHandler()
+    handler.setFormatter(_JsonFormatter() if json_format else _TextFormatter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(logging.WARNING if quiet else logging.DEBUG if verbose else logging.INFO)
+    logger.propagate = False
+
+def _log(level: int, message: str, fields: dict):
+    if not logger.handlers:
+        configure_logging()
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'fields': fields})
+
+def log_debug(message: str, **fields):
+    _log(logging.DEBUG, message, fields)
+
+def log_info(message: str, **fields):
+    _log(logging.INFO, message, fields)
+
+def log_success(message: str, **fields):
+    _log(SUCCESS, message, fields)
+
+def log_warning(message: str, **fields):
+    _log(logging.WARNING, message, fields)
+
+def log_error(message: str, **fields):
+    _log(logging.ERROR, message, fields)
+
+def validate_config(config: json):
+    """Check the structure of a configuration, raising ValueError listing every problem found."""
+    problems = []
+    if not isinstance(config, dict):
+        raise ValueError("Invalid configuration: the top level must be an object")
+    tools = config.get('tools', {})
+    if not isinstance(tools, dict):
+        problems.append("'tools' must be an object")
+        tools = {}
+    for tool_name, tool_info in tools.items():
+        if not isinstance(tool_info, dict):
+            problems.append(f"tool '{tool_name}' must be an object")
+            continue
+        for key in ('link', 'name'):
+            if not isinstance(tool_info.get(key), str):
+                problems.append(f"tool '{tool_name}' needs a string '{key}'")
+        if not isinstance(tool_info.get('enable', False), bool):
+            problems.append(f"tool '{tool_name}' has a non boolean 'enable'")
+        dependencies = tool_info.get('dependencies', [])
+        if not isinstance(dependencies, list) or not all(isinstance(dep, str) for dep in dependencies):
+            problems.append(f"tool '{tool_name}' needs 'dependencies' to be a list of tool names")
+        recipe = tool_info.get('install')
+        if recipe is None:
+            continue
+        if not isinstance(recipe, dict) or recipe.get('type') not in INSTALL_RECIPES:
+            problems.append(f"tool '{tool_name}' needs 'install.type' to be one of {', '.join(INSTALL_RECIPES)}")
+            continue
+        for key in ('path', 'post', 'packages'):
+            if not isinstance(recipe.get(key, []), list) or not all(isinstance(item, str) for item in recipe.get(key, [])):
+                problems.append(f"tool '{tool_name}' needs 'install.{key}' to be a list of strings")
+        if recipe['type'] == 'archive' and not isinstance(recipe.get('target'), str):
+            problems.append(f"tool '{tool_name}' needs a string 'install.target' for an archive")
+        for key in ('python', 'platform'):
+            if not isinstance(recipe.get(key, ''), str):
+                problems.append(f"tool '{tool_name}' needs 'install.{key}' to be a string")
+    vm_config = config.get('vmConfig', {})
+    if not isinstance(vm_config, dict):
+        problems.append("'vmConfig' must be an object")
+    elif not isinstance(vm_config.get('MappedFolder', []), list):
+        problems.append("'vmConfig.MappedFolder' must be a list")
+    else:
+        for folder in vm_config.get('MappedFolder', []):
+            if not isinstance(folder, dict) or 'HostFolder' not in folder:
+                problems.append("every 'vmConfig.MappedFolder' entry needs a 'HostFolder'")
+    for section in ('downloadConfig', 'cacheConfig', 'profilingConfig', 'telemetryConfig'):
+        if not isinstance(config.get(section, {}), dict):
+            problems.append(f"'{section}' must be an object")
+    mirrors = config.get('downloadConfig', {}).get('mirrors', []) if isinstance(config.get('downloadConfig', {}), dict) else []
+    if not isinstance(mirrors, list) or not all(isinstance(mirror, str) for mirror in mirrors):
+        problems.append("'downloadConfig.mirrors' must be a list of URLs or folders")
+    if problems:
+        raise ValueError("Invalid configuration: " + "; ".join(problems))
 
 def get_config()->json:
-    """Load configuration from config.json."""
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-    with open(config_path, 'r') as file:
-        return json.load(file)
-
-def save_config(config: json):
-    """Save the updated configuration back to config.json."""
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-    with open(config_path, 'w') as file:
-        json.dump(config, file, indent=4)
-    print("[+] Configuration saved successfully.")
+    """Load configuration from config.json.
+
+    The file is read and validated once per process; every caller shares the same
+    in-memory configuration afterwards."""
+    global _config
+    if _config is None:
+        with open(CONFIG_PATH, 'r') as file:
+            config = json.load(file)
+        validate_config(config)
+        _config = config
+    return _config
+
+def mark_config_dirty(section: str, key: str):
+    """Record that a tool or vmConfig key changed and has to be written by save_config."""
+    _config_dirty.setdefault(section, set()).add(key)
+
+def save_config(config: json = None) -> bool:
+    """Save the pending configuration changes back to config.json.
+
+    Nothing is written when no tool or vmConfig key changed. Otherwise the whole file
+    is written once, to a temporary file renamed over config.json."""
+    changes = sum(len(keys) for keys in _config_dirty.values())
+    if not changes:
+        return False
+    tmp_path = CONFIG_PATH + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(config if config is not None else _config, file, indent=4)
+    os.replace(tmp_path, CONFIG_PATH)
+    _config_dirty.clear()
+    log_success(f"Configuration saved successfully ({changes} changes).")
+    return True
+
+def _fingerprint(kind: str, inputs) -> str:
+    """Fingerprint the inputs a generated file is rendered from, and the generator version."""
+    payload = json.dumps([kind, GENERATOR_VERSION, inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _stored_fingerprint(path: str) -> str:
+    """Return the fingerprint recorded at the top of a generated file, or None."""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            head = file.read(256)
+    except FileNotFoundError:
+        return None
+    match = FINGERPRINT_PATTERN.search(head)
+    return match.group(1) if match else None
+
+def write_if_changed(path: str, content: str) -> bool:
+    """Write a generated file through a temporary file renamed over it, unless it already holds content."""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            if file.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+def build_dependency_graph(tools: dict) -> dict:
+    """Build the dependency graph of a tool catalog in one pass.
+
+    Strongly connected components are found with an iterative Tarjan walk, which
+    also yields the tools in dependency-first order. The transitive closure of each
+    component is computed once from its dependencies' closures, so shared subgraphs
+    are never walked twice. Cycles and dependencies on unknown tools are reported
+    in 'cycles' and 'missing' instead of being silently dropped."""
+    dependencies = {}
+    missing = {}
+    for name, tool_info in tools.items():
+        deps = tool_info.get('dependencies', [])
+        dependencies[name] = [dep for dep in deps if dep in tools]
+        unknown = [dep for dep in deps if dep not in tools]
+        if unknown:
+            missing[name] = unknown
+
+    position = {name: i for i, name in enumerate(tools)}
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in dependencies:
+        if root in index:
+            continue
+        work = [(root, iter(dependencies[root]))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            child = next(children, None)
+            if child is not None:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(dependencies[child])))
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+                continue
+            work.pop()
+            if work:
+                lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+    # Tarjan emits components dependencies first, so every closure it needs is already known
+    component_of = {}
+    closure = {}
+    cycles = []
+    order = []
+    for component in components:
+        members = set(component)
+        reachable = set()
+        for member in component:
+            component_of[member] = members
+            for dep in dependencies[member]:
+                reachable.add(dep)
+                if dep not in members:
+                    reachable |= closure[dep]
+        if len(component) > 1 or component[0] in dependencies[component[0]]:
+            cycles.append(sorted(component))
+        for member in component:
+            closure[member] = frozenset(reachable - {member})
+        order.extend(sorted(component, key=position.get))
+
+    dependents = {name: set() for name in dependencies}
+    for name, reachable in closure.items():
+        for dep in reachable:
+            dependents[dep].add(name)
+
+    return {
+        'dependencies': dependencies,
+        'closure': closure,
+        'dependents': {name: frozenset(names) for name, names in dependents.items()},
+        'component': component_of,
+        'order': order,
+        'cycles': cycles,
+        'missing': missing,
+    }
+
+def get_dependency_graph(config: json) -> dict:
+    """Return the dependency graph of a configuration, building it only once per tool catalog."""
+    tools = config.get('tools', {})
+    cached = _dependency_graphs.get(id(tools))
+    if cached is None or cached[0] is not tools:
+        cached = (tools, build_dependency_graph(tools))
+        _dependency_graphs[id(tools)] = cached
+    return cached[1]
 
 def toggle_tool(config: json, tool_name: str) -> json:
     """Toggle the enable state of a tool in the configuration."""
     if tool_name in config.get('tools', {}):
         current_state = config['tools'][tool_name].get('enable', False)
         config['tools'][tool_name]['enable'] = not current_state
+        mark_config_dirty('tools', tool_name)
         
         if not current_state:  # If we're enabling the tool
-            print(f"[+] Enabled {tool_name}.")
+            log_success(f"Enabled {tool_name}.")
             # Check and enable dependencies
             config = check_and_enable_dependencies(config, tool_name)
         else:  # If we're disabling the tool
-            print(f"[+] Disabled {tool_name}.")
-            # Check if any other enabled tools depend on this one
+            log_success(f"Disabled {tool_name}.")
+            # Check if any other enabled tools depend on this one, directly or not
             tools = config.get('tools', {})
-            dependent_tools = []
-            for other_tool, other_info in tools.items():
-                if other_info.get('enable', False) and tool_name in other_info.get('dependencies', []):
-                    dependent_tools.append(other_tool)
-            
+            dependents = get_dependency_graph(config)['dependents'][tool_name]
+            dependent_tools = [other_tool for other_tool in tools if other_tool in dependents and tools[other_tool].get('enable', False)]
+
             if dependent_tools:
-                print(f"[!] Warning: The following tools depend on {tool_name}: {', '.join(dependent_tools)}")
-                print(f"[!] Consider disabling these tools first or they may not work properly.")
-        
-        save_config(config)
+                log_warning(f"The following tools depend on {tool_name}: {', '.join(dependent_tools)}")
+                log_warning(f"Consider disabling these tools first or they may not work properly.")
     else:
-        print(f"[-] Tool {tool_name} not found in configuration.")
+        log_error(f"Tool {tool_name} not found in configuration.")
     return config
 
 
+def get_cache_config(config: dict) -> dict:
+    """Return the installer cache settings, filling in defaults for missing keys."""
+    settings = dict(DEFAULT_CACHE_CONFIG)
+    settings.update(config.get('cacheConfig', {}))
+    return settings
+
+def get_cache_dir(config: dict) -> str:
+    """Return the directory of the content-addressed installer store."""
+    return os.path.join(os.path.dirname(__file__), get_cache_config(config)['path'])
+
+def get_profiling_config(config: dict) -> dict:
+    """Return the boot profiling settings, filling in defaults for missing keys."""
+    settings = dict(DEFAULT_PROFILING_CONFIG)
+    settings.update(config.get('profilingConfig', {}))
+    return settings
+
+def get_boot_log_dir(config: dict) -> str:
+    """Return the host folder the instrumented setup.cmd writes its boot timings to."""
+    return os.path.join(os.path.dirname(__file__), get_profiling_config(config)['logDir'], 'boot')
+
+def get_telemetry_config(config: dict) -> dict:
+    """Return the telemetry settings, filling in defaults for missing keys."""
+    settings = dict(DEFAULT_TELEMETRY_CONFIG)
+    settings.update(config.get('telemetryConfig', {}))
+    return settings
+
+def load_manifest(cache_dir: str) -> dict:
+    """Load the installer store manifest, reading it from disk only once per process."""
+    if cache_dir not in _manifests:
+        try:
+            with open(os.path.join(cache_dir, 'manifest.json'), 'r') as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            manifest = {}
+        for section in ('entries', 'objects', 'profiles'):
+            manifest.setdefault(section, {})
+        _manifests[cache_dir] = manifest
+    return _manifests[cache_dir]
+
+def save_manifest(cache_dir: str):
+    """Atomically write the in-memory manifest of an installer store back to disk."""
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(_manifests[cache_dir], file, indent=4)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def _object_path(cache_dir: str, sha256: str) -> str:
+    """Return the path of a stored installer from its SHA-256."""
+    return os.path.join(cache_dir, 'objects', sha256[:2], sha256)
+
+def _cached_entry(manifest: dict, tool_info: dict) -> dict:
+    """Return the manifest entry of a tool if the store holds an up to date installer for its current link."""
+    entry = manifest['entries'].get(tool_info.get('name', ''))
+    if (entry and not entry.get('stale') and entry.get('url') == tool_info.get('link')
+            and entry.get('sha256') in manifest['objects']):
+        return entry
+    return None
+
+def _usable_entry(manifest: dict, tool_info: dict) -> dict:
+    """Return the manifest entry of the installer to use for a tool: the up to date one or, while an
+    update could not be downloaded yet, the previous installer marked stale by check_for_updates."""
+    entry = _cached_entry(manifest, tool_info)
+    if entry is not None:
+        return entry
+    entry = manifest['entries'].get(tool_info.get('name', ''))
+    if (entry and entry.get('stale') and entry.get('url') == tool_info.get('link')
+            and entry.get('sha256') in manifest['objects']):
+        return entry
+    return None
+
+def store_object(cache_dir: str, tool_info: dict, path: str, sha256: str, keep_source: bool = False, validators: dict = None):
+    """Add a file to the store under its SHA-256 and point the tool's manifest entry at it.
+
+    A file whose content is already stored is dropped instead of being kept twice. The
+    ETag/Last-Modified validators are kept so the entry can be revalidated later."""
+    manifest = load_manifest(cache_dir)
+    target = _object_path(cache_dir, sha256)
+    if sha256 in manifest['objects'] and os.path.exists(target):
+        if not keep_source:
+            os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if keep_source:
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+        else:
+            os.replace(path, target)
+
+    now = time.time()
+    size = os.path.getsize(target)
+    manifest['objects'][sha256] = {'size': size, 'lastUsed': now}
+    manifest['entries'][tool_info['name']] = {
+        'url': tool_info.get('link'),
+        'version': tool_info.get('version'),
+        'size': size,
+        'sha256': sha256,
+        'lastUsed': now,
+        'etag': (validators or {}).get('etag'),
+        'lastModified': (validators or {}).get('lastModified'),
+    }
+
+def _drop_object(manifest: dict, sha256: str):
+    """Forget a stored installer and every manifest entry pointing at it."""
+    manifest['objects'].pop(sha256, None)
+    for name in [name for name, entry in manifest['entries'].items() if entry['sha256'] == sha256]:
+        del manifest['entries'][name]
+
+def _link_setup_files(cache_dir: str, manifest: dict, required: list) -> list:
+    """Link the stored installer of every required file into scripts/setups.
+
+    An installer whose object was removed from the store behind its back is adopted again from
+    its scripts/setups copy when one is left. Returns the files that are lost altogether, their
+    entries dropped so they can be downloaded again."""
+    lost = []
+    for tool_info in required:
+        entry = _usable_entry(manifest, tool_info)
+        if entry is None:
+            continue
+        try:
+            _link_setup_file(cache_dir, tool_info['name'], entry['sha256'])
+        except FileNotFoundError:
+            _drop_object(manifest, entry['sha256'])
+            if _adopt_setup_file(cache_dir, tool_info) is None:
+                lost.append(tool_info)
+    return lost
+
+def _link_setup_file(cache_dir: str, name: str, sha256: str):
+    """Expose a stored installer under its file name in scripts/setups without copying it."""
+    source = _object_path(cache_dir, sha256)
+    target = os.path.join(SETUPS_DIR, name)
+    try:
+        if os.path.samefile(source, target):
+            return
+    except FileNotFoundError:
+        pass
+    tmp_path = target + '.link'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        # Hard links are not available on every filesystem
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+def evict_cache(config: dict) -> int:
+    """Evict installers no profile references, least recently used first, until the store fits its budget.
+
+    Returns the number of bytes freed."""
+    cache_dir = get_cache_dir(config)
+    manifest = load_manifest(cache_dir)
+    budget = int(get_cache_config(config)['maxSizeMB']) * 1024 * 1024
+    total = sum(obj['size'] for obj in manifest['objects'].values())
+    if total <= budget:
+        return 0
+
+    referenced = set()
+    for names in manifest['profiles'].values():
+        for name in names:
+            if name in manifest['entries']:
+                referenced.add(manifest['entries'][name]['sha256'])
+    candidates = sorted((obj['lastUsed'], sha256) for sha256, obj in manifest['objects'].items() if sha256 not in referenced)
+
+    freed = 0
+    for _, sha256 in candidates:
+        if total <= budget:
+            break
+        object_path = _object_path(cache_dir, sha256)
+        for name, entry in list(manifest['entries'].items()):
+            if entry['sha256'] == sha256:
+                setup_path = os.path.join(SETUPS_DIR, name)
+                if os.path.exists(setup_path) and os.path.samefile(setup_path, object_path):
+                    os.remove(setup_path)
+                del manifest['entries'][name]
+        if os.path.exists(object_path):
+            os.remove(object_path)
+        shutil.rmtree(os.path.join(cache_dir, 'extracted', sha256), ignore_errors=True)
+        size = manifest['objects'].pop(sha256)['size']
+        total -= size
+        freed += size
+        log_info(f"Evicted {sha256[:12]} from the installer cache ({_format_size(size)})")
+
+    if total > budget:
+        log_warning(f"Installer cache is {_format_size(total)}, over its budget, but every installer is still referenced.")
+    return freed
+
+def _needs_installer(tool_info: dict) -> bool:
+    """Tell whether a tool is enabled and installed from a downloaded file."""
+    name = tool_info.get('name', '')
+    return tool_info.get('enable', False) and bool(name) and name.lower() != 'none'
+
+def _required_setup_files(config: dict) -> list:
+    """List the downloadable installers of the enabled tools, plus the always-installed 7-Zip."""
+    required = [{'name': SEVEN_ZIP_NAME, 'link': SEVEN_ZIP_LINK, 'version': SEVEN_ZIP_VERSION}]
+    required += [tool_info for tool_info in config.get('tools', {}).values() if _needs_installer(tool_info)]
+    return required
+
 def get_missing_setup_files(config: json) -> list:
-    """Get a list of setup files that are missing based on the configuration."""
+    """Get a list of setup files that are missing based on the configuration.
+
+    Presence is a lookup in the installer store manifest. A file left in scripts/setups
+    by an older version of this script is adopted into the store instead of being
+    downloaded again."""
+    cache_dir = get_cache_dir(config)
+    now = time.time()
     missing_files = []
+    checked = 0
     for tool_name, tool_info in config.get('tools', {}).items():
         if tool_info.get('enable', False):
             # Skip tools that don't require file downloads (like pip installs)
             tool_name_value = tool_info.get('name', '')
             if not tool_name_value or tool_name_value.lower() in ['none', '']:
-                print(f"[*] Skipping {tool_name} - no file download required")
+                log_debug(f"Skipping {tool_name} - no file download required")
                 continue
-                
-            file_path = os.path.join(os.path.dirname(__file__), 'scripts', 'setups', tool_name_value)
-            if not os.path.exists(file_path):
-                print(f"[*] Missing: {tool_name_value}")
+
+            checked += 1
+            if _lookup_setup_file(cache_dir, tool_info, now) is None:
+                log_debug(f"Missing: {tool_name_value}")
                 missing_files.append(tool_info)
             else:
-                print(f"[*] Found: {tool_name_value}")
+                log_debug(f"Found: {tool_name_value}")
+    log_info(f"{len(missing_files)} of {checked} setup files missing.", missing=len(missing_files), checked=checked)
     return missing_files
 
-def download_7zip():
-    file_path = os.path.join(os.path.dirname(__file__), 'scripts', 'setups')
-    os.makedirs(file_path, exist_ok=True)
+def _lookup_setup_file(cache_dir: str, tool_info: dict, now: float) -> dict:
+    """Return the manifest entry of a stored installer and mark it as used, or None if it is missing."""
+    manifest = load_manifest(cache_dir)
+    entry = _cached_entry(manifest, tool_info)
+    if entry is None and tool_info['name'] not in manifest['entries']:
+        entry = _adopt_setup_file(cache_dir, tool_info)
+    if entry is not None:
+        entry['lastUsed'] = manifest['objects'][entry['sha256']]['lastUsed'] = now
+    return entry
+
+def _adopt_setup_file(cache_dir: str, tool_info: dict) -> dict:
+    """Move an installer downloaded before the store existed into it, if it is present and valid."""
+    setup_path = os.path.join(SETUPS_DIR, tool_info['name'])
+    if not os.path.isfile(setup_path):
+        return None
+    sha256 = _hash_file(setup_path).hexdigest()
+    if tool_info.get('sha256') and tool_info['sha256'].lower() != sha256:
+        return None
+    store_object(cache_dir, tool_info, setup_path, sha256, keep_source=True)
+    return load_manifest(cache_dir)['entries'][tool_info['name']]
+
+def get_download_config(config: dict) -> dict:
+    """Return the download settings, filling in defaults for missing keys."""
+    settings = dict(DEFAULT_DOWNLOAD_CONFIG)
+    settings.update(config.get('downloadConfig', {}))
+    return settings
+
+def get_session(pool_size: int = 10) -> requests.Session:
+    """Return the shared keep-alive HTTP session used for every download."""
+    import requests
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+def _format_size(num_bytes: float) -> str:
+    """Format a byte count as a short human readable string."""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+def _load_part_state(part_path: str) -> dict:
+    """Load the sidecar state describing a partial download, if any."""
+    try:
+        with open(part_path + '.json', 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _save_part_state(part_path: str, state: dict):
+    """Atomically write the sidecar state of a partial download."""
+    tmp_path = part_path + '.json.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(state, file)
+    os.replace(tmp_path, part_path + '.json')
+
+def _discard_partial(part_path: str):
+    """Remove a partial download and its sidecar state."""
+    for path in (part_path, part_path + '.json'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _download_timeouts(size: int, settings: dict) -> tuple:
+    """Return the (connect, read) timeouts for a download, growing with the logarithm of its size.
+
+    A 1 MB file gets about 1.3 times the configured timeouts, a 200 MB one about 3.3 times."""
+    scale = 1 + math.log10(1 + size / (1024 * 1024))
+    return float(settings['connectTimeout']) * scale, float(settings['readTimeout']) * scale
+
+def _retry_after(response: requests.Response) -> float:
+    """Return how many seconds a Retry-After header asks to wait, or None."""
+    value = response.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return float(value)
+    import email.utils
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class IntegrityError(IOError):
+    """A download that completed with the wrong size or SHA-256, downloading it again would not help."""
+
+def _retry_delay(error: Exception, attempt: int, settings: dict) -> float:
+    """Return how long to wait before retrying a failed download, or None when it should not be retried.
+
+    Delays grow exponentially with the attempt, with random jitter so downloads failing together
+    do not retry together. A Retry-After header from the server is honored, up to maxBackoffSeconds."""
+    import requests
+    if attempt >= int(settings['retries']) or not isinstance(error, OSError) or isinstance(error, IntegrityError):
+        return None
+    # Local file errors will not go away by waiting
+    if not isinstance(error, requests.RequestException) and getattr(error, 'filename', None):
+        return None
+    response = getattr(error, 'response', None)
+    if isinstance(error, requests.HTTPError) and response is not None and response.status_code not in RETRY_STATUSES:
+        return None
+    ceiling = float(settings['maxBackoffSeconds'])
+    backoff = min(ceiling, float(settings['backoffSeconds']) * 2 ** attempt)
+    delay = backoff / 2 + random.uniform(0, backoff / 2)
+    retry_after = _retry_after(response) if response is not None else None
+    if retry_after is not None:
+        delay = min(max(delay, retry_after), ceiling)
+    return delay
+
+def _probe_download(session: requests.Session, url: str, timeout: tuple) -> dict:
+    """Send a HEAD request to learn the size, range support and validator of a download."""
+    import requests
+    info = {'size': 0, 'ranges': False, 'validator': None, 'etag': None, 'lastModified': None}
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+    except requests.RequestException:
+        return info
+    if response.ok:
+        etag = response.headers.get('ETag', '')
+        info['size'] = int(response.headers.get('Content-Length') or 0)
+        info['ranges'] = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        info['etag'] = etag or None
+        info['lastModified'] = response.headers.get('Last-Modified')
+        # Weak ETags cannot be used with If-Range, fall back to Last-Modified
+        info['validator'] = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+    return info
+
+def _hash_file(path: str, digest=None):
+    """Feed the contents of a file into a SHA-256 digest and return it."""
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest
+
+def _hash_file_prefix(path: str, length: int, digest):
+    """Feed the first length bytes of a file into a SHA-256 digest."""
+    with open(path, 'rb') as f:
+        while length > 0:
+            block = f.read(min(1024 * 1024, length))
+            if not block:
+                break
+            digest.update(block)
+            length -= len(block)
+
+def _pipe_to_file(readinto, f, limit: int = None, digest=None, on_write=None, cancel: threading.Event = None) -> int:
+    """Copy a stream into an open file through a small pool of reusable buffers.
+
+    The calling thread only fills preallocated buffers with readinto, while a second
+    thread hashes and writes them, so network reads, SHA-256 and disk writes overlap
+    without allocating per chunk. Stops at the end of the stream or after limit bytes
+    and returns the number of bytes written. Raises InterruptedError once cancel is set,
+    after everything read so far has been written."""
+    free = queue.Queue()
+    for _ in range(STREAM_BUFFERS):
+        free.put(memoryview(bytearray(STREAM_BUFFER_SIZE)))
+    filled = queue.Queue()
+    failure = []
+    written = 0
+
+    def drain():
+        nonlocal written
+        while True:
+            item = filled.get()
+            if item is None:
+                return
+            view, length = item
+            if not failure:
+                try:
+                    chunk = view[:length]
+                    if digest is not None:
+                        digest.update(chunk)
+                    f.write(chunk)
+                    written += length
+                    if on_write is not None:
+                        on_write(length)
+                except BaseException as e:
+                    failure.append(e)
+            free.put(view)
+
+    writer = threading.Thread(target=drain, daemon=True)
+    writer.start()
+    remaining = limit
     try:
-        print("[*] Downloading 7-Zip...")
-        response = requests.get("https://www.7-zip.org/a/7z2409-x64.msi", stream=True, allow_redirects=True, timeout=30)
+        while remaining is None or remaining > 0:
+            view = free.get()
+            if failure:
+                break
+            if cancel is not None and cancel.is_set():
+                free.put(view)
+                failure.append(InterruptedError("Download cancelled"))
+                break
+            length = readinto(view if remaining is None or remaining >= len(view) else view[:remaining])
+            if not length:
+                break
+            filled.put((view, length))
+            if remaining is not None:
+                remaining -= length
+    finally:
+        filled.put(None)
+        writer.join()
+    if failure:
+        raise failure[0]
+    return written
+
+def _body_reader(response: requests.Response):
+    """Return a readinto for the raw body of a streamed response.
+
+    The body is only decoded if the server compressed it despite Accept-Encoding: identity,
+    and urllib3 errors are raised as the requests exceptions iter_content would raise."""
+    import requests
+    from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+    raw = response.raw
+    if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        raw.decode_content = True
+
+    def readinto(buffer) -> int:
+        try:
+            return raw.readinto(buffer)
+        except ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except DecodeError as e:
+            raise requests.exceptions.ContentDecodingError(e)
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+    return readinto
+
+def _download_stream(session: requests.Session, url: str, part_path: str, state: dict, progress: dict, timeout: tuple) -> str:
+    """Download into a .part file over one connection, resuming from the bytes its state records.
+
+    A file of known size is preallocated up front. The SHA-256 is computed while
+    streaming and returned as a hex digest."""
+    if not os.path.exists(part_path):
+        open(part_path, 'wb').close()
+    # State written before preallocation existed only has the file size to go by
+    offset = min(state.get('written', os.path.getsize(part_path)), os.path.getsize(part_path))
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        if state['validator']:
+            headers['If-Range'] = state['validator']
+
+    with session.get(url, headers=headers, stream=True, allow_redirects=True, timeout=timeout) as response:
+        progress['httpStatus'] = response.status_code
+        if offset and response.status_code == 416:
+            # Nothing left to fetch, the size check in finalize decides if the file is good
+            progress['done'] = offset
+            return _hash_file(part_path).hexdigest()
         response.raise_for_status()
-        with open(os.path.join(file_path, '7z2409-x64.msi'), 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print("[+] 7-Zip downloaded successfully.")
-    except requests.RequestException as e:
-        print(f"[-] Failed to download 7-Zip: {e}")
-
-def download_missing_setup_files(config: json):
-    """Download setup files that are missing."""
-    file_path = os.path.join(os.path.dirname(__file__), 'scripts', 'setups')
-    os.makedirs(file_path, exist_ok=True)
-    
-    tools_to_download = get_missing_setup_files(config)
-    
-    if not tools_to_download:
-        print("[+] No files need to be downloaded.")
-        return
+        digest = hashlib.sha256()
+        if response.status_code != 206:
+            offset = 0
+        elif offset:
+            # Only the resumed prefix has to be read back from disk
+            _hash_file_prefix(part_path, offset, digest)
+        length = int(response.headers.get('Content-Length') or 0)
+        if length:
+            progress['total'] = offset + length
+        progress['done'] = progress['resumed'] = state['written'] = offset
+        unsaved = 0
 
-    print(f"[*] Need to download {len(tools_to_download)} files...")
-    
-    for tool_info in tools_to_download:
-        tool_name = tool_info.get('name', '')
-        tool_link = tool_info.get('link', '')
-        
+        with open(part_path, 'r+b') as f:
+            if progress['total']:
+                f.truncate(progress['total'])
+            f.seek(offset)
+
+            def written(length: int):
+                nonlocal unsaved
+                progress['done'] += length
+                state['written'] += length
+                unsaved += length
+                if unsaved >= STATE_SAVE_INTERVAL:
+                    f.flush()
+                    _save_part_state(part_path, state)
+                    unsaved = 0
+
+            try:
+                _pipe_to_file(_body_reader(response), f, digest=digest, on_write=written, cancel=progress.get('cancel'))
+            finally:
+                f.flush()
+                _save_part_state(part_path, state)
+            if not progress['total']:
+                f.truncate(state['written'])
+    if progress['total'] and state['written'] < progress['total']:
+        # The connection ended early, the preallocated tail is not data yet
+        raise IOError(f"Incomplete download of {os.path.basename(url)}: {state['written']} of {progress['total']} bytes")
+    return digest.hexdigest()
+
+def _download_segments(session: requests.Session, url: str, part_path: str, state: dict, progress: dict, timeout: tuple,
+                       host_slot: threading.BoundedSemaphore) -> str:
+    """Download a preallocated .part file as parallel byte-range segments.
+
+    The caller holds one slot of the host; every further parallel connection takes one of
+    its free slots, so segments never exceed the per-host limit, and the download runs on
+    a single connection when the other slots are busy. Each segment records how many bytes it has written in the sidecar state, so an
+    interrupted download only re-fetches what is missing. The SHA-256 is computed by a
+    thread following the contiguous prefix of written bytes while the later segments are
+    still downloading, and returned as a hex digest. Those bytes are read back while they
+    are still in the page cache, so hashing overlaps the download instead of following it."""
+    import requests
+    segments = state['segments']
+    lock = threading.Lock()
+    changed = threading.Condition(lock)
+    progress['done'] = progress['resumed'] = sum(segment[2] for segment in segments)
+    digest = hashlib.sha256()
+    hashed = 0
+    stop = None
+
+    def contiguous() -> int:
+        for start, end, done in segments:
+            if start + done <= end:
+                return start + done
+        return state['size']
+
+    def hash_prefix():
+        nonlocal hashed
+        # Unbuffered, so read-ahead never caches preallocated zeros the segments have not overwritten yet
+        with open(part_path, 'rb', buffering=0) as f:
+            while True:
+                with changed:
+                    while contiguous() <= hashed and stop is None:
+                        changed.wait()
+                    limit = contiguous()
+                if stop == 'abort' or limit <= hashed:
+                    return
+                while hashed < limit and stop != 'abort':
+                    f.seek(hashed)
+                    block = f.read(min(STREAM_BUFFER_SIZE, limit - hashed))
+                    if not block:
+                        return
+                    digest.update(block)
+                    hashed += len(block)
+
+    def fetch(segment: list):
+        start, end = segment[0], segment[1]
+        if start + segment[2] > end:
+            return
+        headers = {'Range': f'bytes={start + segment[2]}-{end}', 'Accept-Encoding': 'identity'}
+        if state['validator']:
+            headers['If-Range'] = state['validator']
+        unsaved = 0
+        try:
+            with session.get(url, headers=headers, stream=True, allow_redirects=True, timeout=timeout) as response:
+                progress['httpStatus'] = response.status_code
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise requests.RequestException(f"Server ignored range request for {url}")
+                with open(part_path, 'r+b') as f:
+                    f.seek(start + segment[2])
+
+                    def written(length: int):
+                        nonlocal unsaved
+                        # The hashing thread reads these bytes through its own handle
+                        f.flush()
+                        with changed:
+                            segment[2] += length
+                            progress['done'] += length
+                            changed.notify()
+                        unsaved += length
+                        if unsaved >= STATE_SAVE_INTERVAL:
+                            f.flush()
+                            with lock:
+                                _save_part_state(part_path, state)
+                            unsaved = 0
+
+                    _pipe_to_file(_body_reader(response), f, limit=end + 1 - start - segment[2], on_write=written,
+                                  cancel=progress.get('cancel'))
+        finally:
+            with lock:
+                _save_part_state(part_path, state)
+
+    pending = [segment for segment in segments if segment[0] + segment[2] <= segment[1]]
+    extra_slots = 0
+    while extra_slots < len(pending) - 1 and host_slot.acquire(blocking=False):
+        extra_slots += 1
+    hasher = threading.Thread(target=hash_prefix, daemon=True)
+    hasher.start()
+    outcome = 'abort'
+    try:
+        with ThreadPoolExecutor(max_workers=1 + extra_slots) as executor:
+            list(executor.map(fetch, pending))
+        outcome = 'done'
+    finally:
+        for _ in range(extra_slots):
+            host_slot.release()
+        with changed:
+            stop = outcome
+            changed.notify_all()
+        hasher.join()
+    missing = sum(end + 1 - start - done for start, end, done in segments)
+    if missing:
+        # A segment ended early, the preallocated file has the right size but not the data
+        raise IOError(f"Incomplete download of {os.path.basename(url)}: {missing} bytes missing")
+    # Should the file have been cut short under the hasher, finalize hashes it again
+    return digest.hexdigest() if hashed == state['size'] else None
+
+def _finalize_download(part_path: str, job: dict, expected_size: int, sha256: str = None) -> str:
+    """Check the size and optional SHA-256 of a .part file, then rename it into place.
+
+    Returns the SHA-256 of the file, hashing it here only if it was not computed while streaming."""
+    actual_size = os.path.getsize(part_path)
+    if expected_size and actual_size < expected_size:
+        # Keep the partial file, the next run resumes it
+        raise IOError(f"Incomplete download of {job['name']}: {actual_size} of {expected_size} bytes")
+    if expected_size and actual_size > expected_size:
+        _discard_partial(part_path)
+        raise IntegrityError(f"Download of {job['name']} is larger than announced ({actual_size} > {expected_size} bytes)")
+
+    sha256 = sha256 or _hash_file(part_path).hexdigest()
+    expected_hash = (job.get('sha256') or '').lower()
+    if expected_hash and sha256 != expected_hash:
+        _discard_partial(part_path)
+        raise IntegrityError(f"SHA-256 mismatch for {job['name']}")
+
+    os.replace(part_path, job['destination'])
+    _discard_partial(part_path)
+    return sha256
+
+def _source_host(location: str) -> str:
+    """Return the key of a download source in the per-host slots: its host, or '' for folders and shares."""
+    return urlparse(location).netloc if location.startswith(('http://', 'https://')) else ''
+
+def _host_slot(host_slots: dict, progress: dict, host: str):
+    """Return the slot to hold while downloading from a host, none for the host the scheduler already reserved."""
+    return contextlib.nullcontext() if host == progress.get('heldHost') else host_slots[host]
+
+def _download_url(session: requests.Session, job: dict, url: str, progress: dict, host_slots: dict, settings: dict) -> dict:
+    """Download a single file from one URL through a resumable .part file, holding one of its host's slots.
+
+    Returns the SHA-256 of the downloaded file and the validators the server sent for it."""
+    part_path = job['destination'] + '.part'
+    with _host_slot(host_slots, progress, urlparse(url).netloc):
+        info = _probe_download(session, url, _download_timeouts(0, settings))
+        state = _load_part_state(part_path)
+        if state and (state.get('link') != url or state.get('size') != info['size']
+                      or state.get('validator') != info['validator'] or not os.path.exists(part_path)):
+            # The upstream file changed since the partial download started
+            state = None
+        if state is None:
+            _discard_partial(part_path)
+        progress['total'] = info['size']
+        timeout = _download_timeouts(info['size'], settings)
+
+        sha256 = None
+        segment_count = int(settings['segments'])
+        threshold = int(settings['segmentThresholdMB']) * 1024 * 1024
+        if info['ranges'] and info['size'] >= threshold and segment_count > 1:
+            if state is None or not state.get('segments'):
+                _discard_partial(part_path)
+                step = -(-info['size'] // segment_count)
+                state = {
+                    'link': url,
+                    'size': info['size'],
+                    'validator': info['validator'],
+                    'segments': [[start, min(start + step, info['size']) - 1, 0] for start in range(0, info['size'], step)],
+                }
+                with open(part_path, 'wb') as f:
+                    f.truncate(info['size'])
+                _save_part_state(part_path, state)
+            sha256 = _download_segments(session, url, part_path, state, progress, timeout, host_slots[urlparse(url).netloc])
+        else:
+            if state is not None and state.get('segments'):
+                _discard_partial(part_path)
+                state = None
+            if state is None:
+                state = {'link': url, 'size': info['size'], 'validator': info['validator'], 'written': 0}
+                _save_part_state(part_path, state)
+            sha256 = _download_stream(session, url, part_path, state, progress, timeout)
+
+        sha256 = _finalize_download(part_path, job, progress['total'], sha256)
+        return {'sha256': sha256, 'etag': info['etag'], 'lastModified': info['lastModified']}
+
+def _copy_file(job: dict, path: str, progress: dict, host_slots: dict) -> dict:
+    """Copy a file from a mirror folder or share, hashing it on the way."""
+    part_path = job['destination'] + '.part'
+    _discard_partial(part_path)
+    digest = hashlib.sha256()
+    with _host_slot(host_slots, progress, ''):
+        progress['total'] = os.path.getsize(path)
+        progress['done'] = progress['resumed'] = 0
+        with open(path, 'rb', buffering=0) as source, open(part_path, 'wb') as f:
+            f.truncate(progress['total'])
+
+            def written(length: int):
+                progress['done'] += length
+
+            if _pipe_to_file(source.readinto, f, digest=digest, on_write=written, cancel=progress.get('cancel')) != progress['total']:
+                raise IOError(f"{path} changed while it was being copied")
+    sha256 = _finalize_download(part_path, job, progress['total'], digest.hexdigest())
+    return {'sha256': sha256, 'etag': None, 'lastModified': None}
+
+def _mirror_location(mirror: str, name: str) -> str:
+    """Return where a mirror keeps an installer: a URL under an HTTP base, or a path in a folder or share."""
+    if mirror.startswith(('http://', 'https://')):
+        return mirror.rstrip('/') + '/' + quote(name)
+    return os.path.join(mirror, name)
+
+def _probe_source(session: requests.Session, job: dict, location: str, timeout: float) -> dict:
+    """Time how fast a source answers for a download, or return None if it cannot serve it.
+
+    A mirror run by serve-cache also reports the upstream URL, validators and SHA-256 of its
+    copy, so a copy of another version is skipped and a good one can be checked and revalidated."""
+    import requests
+    start = time.monotonic()
+    source = {'location': location, 'origin': location == job['link'], 'etag': None, 'lastModified': None, 'sha256': None}
+    if not location.startswith(('http://', 'https://')):
+        if not os.path.isfile(location):
+            return None
+        source['latency'] = time.monotonic() - start
+        return source
+    try:
+        response = session.head(location, allow_redirects=True, timeout=timeout)
+    except requests.RequestException:
+        return None
+    source['latency'] = time.monotonic() - start
+    if source['origin']:
+        # Some origins refuse HEAD, they stay usable as the last resort
+        return source if response.ok else dict(source, latency=math.inf)
+    upstream = response.headers.get('X-Origin-Url')
+    if not response.ok or (upstream and upstream != job['link']):
+        return None
+    source['etag'] = response.headers.get('X-Origin-ETag')
+    source['lastModified'] = response.headers.get('X-Origin-Last-Modified')
+    source['sha256'] = response.headers.get('X-Content-Sha256')
+    return source
+
+def _rank_sources(session: requests.Session, job: dict, settings: dict) -> list:
+    """Probe the upstream URL and every mirror of a download at once, fastest answer first.
+
+    Without mirrors the upstream URL is the only source and nothing is probed."""
+    locations = [_mirror_location(mirror, job['name']) for mirror in settings['mirrors']]
+    if not locations:
+        return [{'location': job['link'], 'origin': True}]
+    locations.append(job['link'])
+    timeout = float(settings['probeTimeout'])
+    with ThreadPoolExecutor(max_workers=len(locations)) as executor:
+        probed = list(executor.map(lambda location: _probe_source(session, job, location, timeout), locations))
+    sources = sorted((source for source in probed if source), key=lambda source: source['latency'])
+    if not any(source['origin'] for source in sources):
+        sources.append({'location': job['link'], 'origin': True})
+    return sources
+
+def _download_file(session: requests.Session, job: dict, progress: dict, host_slots: dict, settings: dict) -> dict:
+    """Download a single file from the fastest of its sources, falling back to the next one on failure.
+
+    Returns the SHA-256 of the downloaded file and the upstream validators for it."""
+    import requests
+    sources = _rank_sources(session, job, settings)
+    for index, source in enumerate(sources):
+        progress['source'] = source['location']
+        try:
+            if source['origin']:
+                return _download_url(session, job, source['location'], progress, host_slots, settings)
+            # Mirrors are only trusted with the content they claim to hold
+            mirror_job = dict(job, sha256=job.get('sha256') or source['sha256'])
+            if source['location'].startswith(('http://', 'https://')):
+                result = _download_url(session, mirror_job, source['location'], progress, host_slots, settings)
+            else:
+                result = _copy_file(mirror_job, source['location'], progress, host_slots)
+            result.update(etag=source['etag'], lastModified=source['lastModified'])
+            return result
+        except InterruptedError:
+            raise
+        except (requests.RequestException, OSError) as e:
+            if index == len(sources) - 1:
+                raise
+            progress['retries'] += 1
+            log_warning(f"{job['name']}: {source['location']} failed ({e}), trying {sources[index + 1]['location']}")
+
+def download_files(jobs: list, config: dict, on_complete=None) -> list:
+    """Download a batch of files concurrently and return one result per job.
+
+    Each job is a dict with 'name', 'link', 'destination' and an optional 'sha256'.
+    Downloads run on a bounded worker pool with a per-host concurrency limit and
+    share one session. Jobs wait in a queue per host and are only handed to a worker
+    once a slot of their host is free, so workers never sit idle behind a busy host
+    while other hosts have work (a worker switching to a mirror still waits for its slots). Files are only renamed into place once they are complete.
+    A download that fails with a transient error is re-queued after a backoff delay,
+    resuming its .part file, while the other downloads go on. Ctrl+C stops every
+    download at its next buffer, keeping the .part files. on_complete is called
+    with the result of each successful download as soon as it finishes."""
+    import requests
+    if not jobs:
+        return []
+    settings = get_download_config(config)
+    max_workers = max(1, int(settings['maxWorkers']))
+    max_per_host = max(1, int(settings['maxPerHost']))
+    session = get_session(max_workers * max(1, int(settings['segments'])))
+
+    host_slots = {}
+    waiting = {}
+    for job in jobs:
+        host = _source_host(job['link'])
+        host_slots.setdefault(host, threading.BoundedSemaphore(max_per_host))
+        waiting.setdefault(host, collections.deque()).append(job)
+    # Mirrors get the same per-host limit, folders and shares share the '' slot
+    for mirror in settings['mirrors']:
+        host_slots.setdefault(_source_host(mirror), threading.BoundedSemaphore(max_per_host))
+    cancel = threading.Event()
+    progress = {
+        job['name']: {'done': 0, 'total': 0, 'resumed': 0, 'fetched': 0, 'retries': 0, 'httpStatus': None, 'source': None,
+                      'started': None, 'cancel': cancel}
+        for job in jobs
+    }
+
+    log_info(f"Downloading {len(jobs)} files ({max_workers} workers, {max_per_host} per host)...")
+    results = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        # Failed downloads waiting for their retry: (ready at, name, job)
+        delayed = []
+
+        def dispatch():
+            # The slot taken here is held by the job until it finishes, then released below
+            for host, queued in waiting.items():
+                while queued and host_slots[host].acquire(blocking=False):
+                    job = queued.popleft()
+                    job_progress = progress[job['name']]
+                    job_progress['started'] = job_progress['started'] or time.monotonic()
+                    job_progress['heldHost'] = host
+                    futures[executor.submit(_download_file, session, job, job_progress, host_slots, settings)] = job
+
+        try:
+            dispatch()
+            while futures or delayed or any(waiting.values()):
+                while delayed and delayed[0][0] <= time.monotonic():
+                    job = heapq.heappop(delayed)[2]
+                    waiting[_source_host(job['link'])].append(job)
+                dispatch()
+                timeout = min(2, max(0, delayed[0][0] - time.monotonic())) if delayed else 2
+                if futures:
+                    finished, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+                    finished = set()
+                for future in finished:
+                    job = futures.pop(future)
+                    job_progress = progress[job['name']]
+                    host_slots[job_progress.pop('heldHost')].release()
+                    error = future.exception()
+                    delay = _retry_delay(error, job_progress['retries'], settings) if error is not None else None
+                    if delay is not None:
+                        # Bytes already written stay in the .part file and are not fetched again
+                        job_progress['fetched'] += job_progress['done'] - job_progress['resumed']
+                        job_progress['resumed'] = job_progress['done']
+                        job_progress['retries'] += 1
+                        heapq.heappush(delayed, (time.monotonic() + delay, job['name'], job))
+                        log_warning(f"{job['name']}: {error}, retrying in {delay:.1f}s "
+                                    f"({job_progress['retries']}/{settings['retries']})",
+                                    file=job['name'], error=str(error), retry=job_progress['retries'], delay=delay)
+                        continue
+                    result = {
+                        'name': job['name'],
+                        'bytes': job_progress['fetched'] + job_progress['done'] - job_progress['resumed'],
+                        'size': job_progress['total'] or job_progress['done'],
+                        'seconds': time.monotonic() - (job_progress['started'] or start),
+                        'retries': job_progress['retries'],
+                        'httpStatus': job_progress['httpStatus'],
+                        'source': job_progress['source'],
+                    }
+                    try:
+                        result.update(ok=True, **future.result())
+                        if on_complete:
+                            on_complete(result)
+                        results.append(result)
+                        log_success(f"({len(results)}/{len(jobs)}) {job['name']} downloaded ({_format_size(job_progress['done'])})",
+                                    file=job['name'], bytes=job_progress['done'])
+                    except requests.RequestException as e:
+                        results.append(dict(result, ok=False, error=str(e)))
+                        log_error(f"({len(results)}/{len(jobs)}) Failed to download {job['name']}: {e}", file=job['name'], error=str(e))
+                    except Exception as e:
+                        results.append(dict(result, ok=False, error=str(e)))
+                        log_error(f"({len(results)}/{len(jobs)}) Error downloading {job['name']}: {e}", file=job['name'], error=str(e))
+                if (futures or delayed or any(waiting.values())) and not finished:
+                    done_bytes = sum(p['done'] for p in progress.values())
+                    fetched_bytes = sum(p['fetched'] + p['done'] - p['resumed'] for p in progress.values())
+                    total_bytes = sum(p['total'] for p in progress.values())
+                    elapsed = time.monotonic() - start
+                    log_info(f"Progress: {len(results)}/{len(jobs)} files, "
+                             f"{_format_size(done_bytes)} of {_format_size(total_bytes)} known, "
+                             f"{_format_size(fetched_bytes / elapsed)}/s",
+                             files=len(results), jobs=len(jobs), bytes=done_bytes, totalBytes=total_bytes,
+                             bytesPerSecond=fetched_bytes / elapsed)
+
+        except KeyboardInterrupt:
+            # Running downloads stop at their next buffer and save their resume state
+            cancel.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            log_warning("Downloads cancelled, the partial files are kept for the next run.")
+            raise
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    total_bytes = sum(result['bytes'] for result in results)
+    succeeded = sum(1 for result in results if result['ok'])
+    log_success(f"Downloaded {succeeded}/{len(jobs)} files, {_format_size(total_bytes)} in {elapsed:.1f}s "
+                f"({_format_size(total_bytes / elapsed)}/s)",
+                succeeded=succeeded, jobs=len(jobs), bytes=total_bytes, seconds=elapsed, bytesPerSecond=total_bytes / elapsed)
+    return results
+
+def _fetch_into_store(tool_infos: list, config: dict) -> list:
+    """Download installers into the store's temp folder and add each file to the store as soon as it completes."""
+    cache_dir = get_cache_dir(config)
+    tmp_dir = os.path.join(cache_dir, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    jobs = [{
+        'name': tool_info['name'],
+        'link': tool_info['link'],
+        'destination': os.path.join(tmp_dir, tool_info['name']),
+        'sha256': tool_info.get('sha256'),
+    } for tool_info in tool_infos]
+    tools_by_name = {tool_info['name']: tool_info for tool_info in tool_infos}
+
+    # Each file is stored as soon as it is complete, so an interrupted batch keeps what it finished
+    def store(result: dict):
+        store_object(cache_dir, tools_by_name[result['name']], os.path.join(tmp_dir, result['name']),
+                     result['sha256'], validators={'etag': result['etag'], 'lastModified': result['lastModified']})
+        save_manifest(cache_dir)
+
+    return download_files(jobs, config, on_complete=store)
+
+def download_7zip(config: dict = None):
+    """Download the 7-Zip installer, which is always installed in the sandbox."""
+    config = config or {}
+    results = _fetch_into_store([_required_setup_files({})[0]], config)
+    save_manifest(get_cache_dir(config))
+    return results
+
+def _metric_records(required: list, results: list, manifest: dict, revalidated: set) -> list:
+    """Build one telemetry record per required installer: downloaded (miss), already stored (hit/revalidated)
+    or neither (unavailable)."""
+    downloaded = {result['name']: result for result in results}
+    records = []
+    for tool_info in required:
+        name = tool_info['name']
+        result = downloaded.get(name)
+        if result is None:
+            entry = _cached_entry(manifest, tool_info)
+            records.append({
+                'file': name,
+                'status': 'ok' if entry is not None else 'missing',
+                'cache': 'unavailable' if entry is None else 'revalidated' if name in revalidated else 'hit',
+                'bytes': 0,
+                'size': entry['size'] if entry is not None else 0,
+                'seconds': 0.0,
+                'bytesPerSecond': 0.0,
+                'retries': 0,
+                'httpStatus': None,
+                'source': None,
+            })
+            continue
+        record = {
+            'file': name,
+            'status': 'ok' if result['ok'] else 'failed',
+            'cache': 'miss',
+            'bytes': result['bytes'],
+            'size': result['size'],
+            'seconds': round(result['seconds'], 3),
+            'bytesPerSecond': round(result['bytes'] / max(result['seconds'], 1e-6)),
+            'retries': result['retries'],
+            'httpStatus': result['httpStatus'],
+            'source': result['source'],
+        }
+        if not result['ok']:
+            record['error'] = result['error']
+        records.append(record)
+    return records
+
+def _prometheus_label(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _prometheus_metrics(records: list, run: dict) -> str:
+    """Render the records of a run as a Prometheus textfile, one series per file and metric."""
+    series = [
+        ('bytes', 'Bytes transferred for the file in the last run.', 'bytes'),
+        ('size_bytes', 'Size of the file.', 'size'),
+        ('seconds', 'Wall time spent downloading the file in the last run.', 'seconds'),
+        ('retries', 'Retries and source fallbacks for the file in the last run.', 'retries'),
+    ]
+    lines = []
+    for metric, help_text, key in series:
+        lines += [f'# HELP sandbox_setup_download_{metric} {help_text}', f'# TYPE sandbox_setup_download_{metric} gauge']
+        for record in records:
+            labels = ','.join(f'{label}="{_prometheus_label(record[label])}"' for label in ('file', 'cache', 'status'))
+            lines.append(f'sandbox_setup_download_{metric}{{{labels}}} {record[key]}')
+    lines += ['# HELP sandbox_setup_cache_files Installers of the last run by cache result.', '# TYPE sandbox_setup_cache_files gauge']
+    for cache in ('hit', 'miss', 'revalidated', 'unavailable'):
+        lines.append(f'sandbox_setup_cache_files{{cache="{cache}"}} {sum(1 for record in records if record["cache"] == cache)}')
+    lines += [
+        '# HELP sandbox_setup_last_run_timestamp_seconds When the last provisioning run finished.',
+        '# TYPE sandbox_setup_last_run_timestamp_seconds gauge',
+        f'sandbox_setup_last_run_timestamp_seconds {run["timestamp"]:.0f}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+def record_download_metrics(config: dict, records: list):
+    """Append the telemetry records of a run to the metrics file, print a summary table and export them.
+
+    The metrics file is JSON Lines, one object per file and run, tagged with the run and host.
+    With telemetryConfig.prometheusFile set, the last run is also written as a Prometheus
+    textfile, replaced atomically so a collector never reads half of it."""
+    import socket
+    settings = get_telemetry_config(config)
+    run = {'run': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': socket.gethostname(), 'timestamp': time.time()}
+
+    if settings['metricsFile']:
+        metrics_path = os.path.join(os.path.dirname(__file__), settings['metricsFile'])
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+        with open(metrics_path, 'a') as file:
+            for record in records:
+                file.write(json.dumps({'run': run['run'], 'host': run['host'], **record}) + '\n')
+    if settings['prometheusFile']:
+        prometheus_path = os.path.join(os.path.dirname(__file__), settings['prometheusFile'])
+        os.makedirs(os.path.dirname(prometheus_path), exist_ok=True)
+        write_if_changed(prometheus_path, _prometheus_metrics(records, run))
+
+    log_info(f"{'File':<42}{'Cache':>12}{'Status':>9}{'Size':>11}{'Time (s)':>10}{'Speed/s':>11}{'Retries':>9}")
+    for record in records:
+        log_info(f"{record['file'][:41]:<42}{record['cache']:>12}{record['status']:>9}{_format_size(record['size']):>11}"
+                 f"{record['seconds']:>10.1f}{_format_size(record['bytesPerSecond']):>11}{record['retries']:>9}", **record)
+    counts = {cache: sum(1 for record in records if record['cache'] == cache) for cache in ('hit', 'miss', 'revalidated', 'unavailable')}
+    transferred = sum(record['bytes'] for record in records)
+    log_info(f"Cache: {counts['hit']} hits, {counts['miss']} misses, {counts['revalidated']} revalidated, "
+             f"{counts['unavailable']} unavailable, "
+             f"{_format_size(transferred)} transferred.", bytes=transferred, **counts)
+
+def download_missing_setup_files(config: json, profile: str = None, revalidated: set = None) -> list:
+    """Download setup files that are missing, including the 7-Zip installer, in one batch.
+
+    Downloads land in the installer store. scripts/setups is then synced with hard links
+    to the stored installers of every enabled tool, and installers no profile references
+    are evicted when the store is over its disk budget. Each installer is recorded in the
+    run's telemetry as a cache hit, a miss, or revalidated when it is in revalidated."""
+    cache_dir = get_cache_dir(config)
+    manifest = load_manifest(cache_dir)
+    os.makedirs(SETUPS_DIR, exist_ok=True)
+
+    required = _required_setup_files(config)
+    manifest['profiles'][profile or CONFIG_PATH] = [tool_info['name'] for tool_info in required]
+
+    tools_to_download = []
+    seven_zip = required[0]
+    if _lookup_setup_file(cache_dir, seven_zip, time.time()) is None:
+        tools_to_download.append(seven_zip)
+    for tool_info in get_missing_setup_files(config):
         # Double-check we have valid download info
-        if not tool_name or not tool_link or tool_name.lower() in ['none', '']:
-            print(f"[-] Skipping invalid tool: {tool_info}")
+        if not tool_info.get('link'):
+            log_error(f"Skipping invalid tool: {tool_info}")
             continue
-            
-        destination = os.path.join(file_path, tool_name)
-        
+        tools_to_download.append(tool_info)
+
+    results = []
+    if tools_to_download:
+        results = _fetch_into_store(tools_to_download, config)
+    else:
+        log_success("No files need to be downloaded.")
+
+    # Object files are only checked here, where they are used, so the scan stays a manifest lookup
+    lost = _link_setup_files(cache_dir, manifest, required)
+    if lost:
+        log_warning(f"Missing from the installer store, downloading again: {', '.join(tool_info['name'] for tool_info in lost)}")
+        results += _fetch_into_store(lost, config)
+        _link_setup_files(cache_dir, manifest, lost)
+    record_download_metrics(config, _metric_records(required, results, manifest, revalidated or set()))
+    evict_cache(config)
+    save_manifest(cache_dir)
+    return results
+
+def exclude_unavailable_tools(config: dict) -> dict:
+    """Return the configuration to generate scripts from, without the tools whose installer is not stored.
+
+    Tools depending on an unavailable tool are left out as well. Without the 7-Zip installer,
+    its install step and the archives it would extract (unless pre-extracted) are left out too,
+    which the returned configuration records as "sevenZip": false. A tool whose update could not
+    be downloaded keeps its previous installer, with a warning. The configuration passed in
+    is not modified, so the next run tries to download the missing installers again."""
+    manifest = load_manifest(get_cache_dir(config))
+    tools = config.get('tools', {})
+    seven_zip_info = _required_setup_files({})[0]
+    outdated = [name for name, tool in tools.items() if _needs_installer(tool)
+                and _cached_entry(manifest, tool) is None and _usable_entry(manifest, tool) is not None]
+    if _cached_entry(manifest, seven_zip_info) is None and _usable_entry(manifest, seven_zip_info) is not None:
+        outdated.append(SEVEN_ZIP_STEP)
+    if outdated:
+        log_warning(f"Keeping the previous installer, the update could not be downloaded: {', '.join(outdated)}",
+                    outdated=outdated)
+    unavailable = [name for name, tool in tools.items() if _needs_installer(tool) and _usable_entry(manifest, tool) is None]
+    seven_zip = _usable_entry(manifest, seven_zip_info) is not None
+    if not seven_zip:
+        recipes = get_install_recipes(config)
+        prebuilt = get_prebuilt_tools(config)
+        unavailable = [SEVEN_ZIP_STEP] + [
+            name for name, tool in tools.items()
+            if name in unavailable or (tool.get('enable', False) and recipes[name]["type"] == "archive" and name not in prebuilt)
+        ]
+    if not unavailable:
+        return config
+    dependents = get_dependency_graph(config)['dependents']
+    blocked = [name for name, tool in tools.items() if tool.get('enable', False) and name not in unavailable
+               and any(name in dependents.get(missing, ()) for missing in unavailable)]
+    available = copy.deepcopy(config)
+    available['sevenZip'] = seven_zip
+    for name in unavailable + blocked:
+        if name in available['tools']:
+            available['tools'][name]['enable'] = False
+    log_warning(f"Leaving out of the generated scripts, their installer is unavailable: {', '.join(unavailable)}",
+                unavailable=unavailable)
+    if blocked:
+        log_warning(f"Also leaving out, they depend on an unavailable tool: {', '.join(blocked)}", blocked=blocked)
+    log_info("Run again to retry the missing installers.")
+    return available
+
+def _revalidate_setup_file(session: requests.Session, tool_info: dict, entry: dict, host_slots: dict, timeout: tuple) -> str:
+    """Send a conditional request for a stored installer.
+
+    Returns 'unchanged', 'changed', or 'unknown' when the server gives nothing to compare."""
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('lastModified'):
+        headers['If-Modified-Since'] = entry['lastModified']
+    if not headers:
+        return 'unknown'
+
+    with host_slots[urlparse(tool_info['link']).netloc]:
+        response = session.head(tool_info['link'], headers=headers, allow_redirects=True, timeout=timeout)
+        if response.status_code in (405, 501):
+            # Some servers refuse HEAD, the conditional GET is closed before its body is read
+            with session.get(tool_info['link'], headers=headers, stream=True, allow_redirects=True, timeout=timeout) as response:
+                pass
+    if response.status_code == 304:
+        return 'unchanged'
+    response.raise_for_status()
+
+    # Servers that ignore conditional headers still let us compare the validators ourselves
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if entry.get('etag') and etag:
+        return 'unchanged' if etag == entry['etag'] else 'changed'
+    if entry.get('lastModified') and last_modified:
+        return 'unchanged' if last_modified == entry['lastModified'] else 'changed'
+    return 'unknown'
+
+def check_for_updates(config: dict, revalidated: set = None) -> list:
+    """Revalidate the stored installers of all enabled tools in parallel.
+
+    Installers whose upstream changed are marked stale in the manifest and returned,
+    so the next download only re-fetches those. The names of the ones confirmed
+    unchanged are added to revalidated."""
+    import requests
+    cache_dir = get_cache_dir(config)
+    manifest = load_manifest(cache_dir)
+    settings = get_download_config(config)
+    max_workers = max(1, int(settings['maxWorkers']))
+    max_per_host = max(1, int(settings['maxPerHost']))
+    session = get_session(max_workers)
+
+    candidates = []
+    for tool_info in _required_setup_files(config):
+        entry = _cached_entry(manifest, tool_info)
+        if entry is not None and tool_info.get('link', '').startswith(('http://', 'https://')):
+            candidates.append((tool_info, entry))
+    if not candidates:
+        log_info("No stored installers to check for updates.")
+        return []
+
+    host_slots = {}
+    for tool_info, _ in candidates:
+        host_slots.setdefault(urlparse(tool_info['link']).netloc, threading.BoundedSemaphore(max_per_host))
+
+    log_info(f"Checking {len(candidates)} installers for updates...")
+    changed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_revalidate_setup_file, session, tool_info, entry, host_slots, _download_timeouts(0, settings)): (tool_info, entry)
+            for tool_info, entry in candidates
+        }
+        for future, (tool_info, entry) in futures.items():
+            try:
+                status = future.result()
+            except requests.RequestException as e:
+                log_error(f"Could not check {tool_info['name']}: {e}")
+                continue
+            if status == 'changed':
+                entry['stale'] = True
+                changed.append(tool_info)
+                log_success(f"Update available: {tool_info['name']}")
+            elif status == 'unchanged' and revalidated is not None:
+                revalidated.add(tool_info['name'])
+            elif status == 'unknown':
+                log_warning(f"{tool_info['name']} has no ETag/Last-Modified to compare, keeping the stored file.")
+
+    save_manifest(cache_dir)
+    log_success(f"{len(changed)} of {len(candidates)} installers changed upstream.")
+    return changed
+
+def update_setup_files(config: dict) -> list:
+    """Re-download only the installers that changed upstream, along with any missing ones.
+
+    The wheelhouses of pip tools on "latest" are rebuilt as well."""
+    revalidated = set()
+    check_for_updates(config, revalidated)
+    results = download_missing_setup_files(config, revalidated=revalidated)
+    prepare_wheelhouses(config, refresh=True)
+    return results
+
+def _read_store_entries(cache_dir: str, loaded: dict) -> dict:
+    """Return the manifest entries of a store, re-reading the manifest only after it changed on disk."""
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    try:
+        mtime = os.path.getmtime(manifest_path)
+    except FileNotFoundError:
+        return {}
+    if loaded.get('mtime') != mtime:
+        with open(manifest_path, 'r') as file:
+            loaded['entries'] = json.load(file).get('entries', {})
+        loaded['mtime'] = mtime
+    return loaded['entries']
+
+def serve_cache(config: dict, bind: str = '', port: int = SERVE_CACHE_PORT):
+    """Serve the installers of the local store over HTTP, for other hosts to use as a mirror.
+
+    Each installer is served under its file name with range support, so resumed and
+    segmented downloads work against it. The upstream URL, validators and SHA-256 of
+    the stored copy are sent along, letting clients check what they received.
+    /index.json lists every installer the store holds."""
+    import email.utils
+    import http.server
+
+    cache_dir = get_cache_dir(config)
+    loaded = {}
+    lock = threading.Lock()
+
+    class CacheHandler(http.server.BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.serve(send_body=False)
+
+        def do_GET(self):
+            self.serve(send_body=True)
+
+        def log_message(self, format, *args):
+            log_debug(f"{self.address_string()} {format % args}")
+
+        def serve(self, send_body: bool):
+            name = unquote(urlparse(self.path).path).lstrip('/')
+            with lock:
+                entries = _read_store_entries(cache_dir, loaded)
+            if name == 'index.json':
+                body = json.dumps({
+                    entry_name: {'url': entry.get('url'), 'size': entry.get('size'), 'sha256': entry.get('sha256')}
+                    for entry_name, entry in entries.items()
+                }, indent=4).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+                return
+            entry = entries.get(name)
+            path = _object_path(cache_dir, entry['sha256']) if entry else None
+            if path is None or not os.path.isfile(path):
+                self.send_error(404, "Not in the installer cache")
+                return
+
+            size = os.path.getsize(path)
+            etag = f'"{entry["sha256"]}"'
+            start, end = 0, size - 1
+            ranged = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+            if ranged and self.headers.get('If-Range', etag) in (etag, entry['sha256']):
+                if ranged.group(1):
+                    start = int(ranged.group(1))
+                    end = min(int(ranged.group(2)), size - 1) if ranged.group(2) else size - 1
+                elif ranged.group(2):
+                    start = max(size - int(ranged.group(2)), 0)
+                if start >= size or start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            else:
+                ranged = None
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', email.utils.formatdate(os.path.getmtime(path), usegmt=True))
+            self.send_header('X-Content-Sha256', entry['sha256'])
+            self.send_header('X-Origin-Url', entry.get('url') or '')
+            if entry.get('etag'):
+                self.send_header('X-Origin-ETag', entry['etag'])
+            if entry.get('lastModified'):
+                self.send_header('X-Origin-Last-Modified', entry['lastModified'])
+            self.end_headers()
+            if not send_body:
+                return
+            remaining = end - start + 1
+            with open(path, 'rb') as file:
+                file.seek(start)
+                while remaining > 0:
+                    block = file.read(min(1024 * 1024, remaining))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+
+    server = http.server.ThreadingHTTPServer((bind, port), CacheHandler)
+    log_success(f"Serving the installer cache {cache_dir} on http://{bind or '0.0.0.0'}:{server.server_port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log_info("Stopping the cache server.")
+    finally:
+        server.server_close()
+
+def _archive_target(recipe: dict) -> tuple:
+    """Return the (subfolder, sandbox folder) an archive recipe is extracted to, or None."""
+    if recipe["type"] != "archive":
+        return None
+    return recipe["subfolder"], recipe["target"]
+
+def _find_7zip() -> str:
+    """Return the path of a local 7-Zip executable, or None."""
+    for candidate in ('7z', '7za', '7zz'):
+        path = shutil.which(candidate)
+        if path:
+            return path
+    program_files = os.environ.get('PROGRAMFILES', 'C:\\Program Files')
+    path = os.path.join(program_files, '7-Zip', '7z.exe')
+    return path if os.path.isfile(path) else None
+
+def _extract_archive(archive_path: str, filename: str, target_dir: str):
+    """Extract a .zip or .7z archive into target_dir."""
+    if filename.lower().endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(archive_path) as archive:
+            archive.extractall(target_dir)
+        return
+    try:
+        import py7zr
+    except ImportError:
+        py7zr = None
+    if py7zr is not None:
+        with py7zr.SevenZipFile(archive_path, mode='r') as archive:
+            archive.extractall(path=target_dir)
+        return
+    seven_zip = _find_7zip()
+    if seven_zip is None:
+        raise RuntimeError("no 7-Zip executable or py7zr module found")
+    subprocess.run([seven_zip, 'x', '-y', f'-o{target_dir}', archive_path], check=True, stdout=subprocess.DEVNULL)
+
+def get_prebuilt_tools(config: dict) -> dict:
+    """Map each enabled archive tool that was extracted on the host to its host and sandbox folders."""
+    if not get_cache_config(config)['preExtract']:
+        return {}
+    cache_dir = get_cache_dir(config)
+    manifest = load_manifest(cache_dir)
+    recipes = get_install_recipes(config)
+    prebuilt = {}
+    for name, tool in config.get('tools', {}).items():
+        target = _archive_target(recipes[name])
+        entry = _usable_entry(manifest, tool) if tool.get('enable', False) and target else None
+        if entry is None:
+            continue
+        extracted_dir = os.path.join(cache_dir, 'extracted', entry['sha256'])
+        if os.path.isdir(extracted_dir):
+            subfolder, sandbox_folder = target
+            prebuilt[name] = {
+                'HostFolder': os.path.abspath(os.path.join(extracted_dir, subfolder)),
+                'SandboxFolder': sandbox_folder,
+            }
+    return prebuilt
+
+def prepare_extracted_tools(config: dict) -> dict:
+    """Extract the archives of enabled tools once on the host, keyed by archive hash.
+
+    The extracted trees are mapped read-only into the sandbox, so nothing has to be
+    unpacked at boot. Does nothing unless cacheConfig.preExtract is set."""
+    if not get_cache_config(config)['preExtract']:
+        return {}
+    cache_dir = get_cache_dir(config)
+    manifest = load_manifest(cache_dir)
+    recipes = get_install_recipes(config)
+    for name, tool in config.get('tools', {}).items():
+        if not tool.get('enable', False) or _archive_target(recipes[name]) is None:
+            continue
+        entry = _usable_entry(manifest, tool)
+        if entry is None:
+            log_error(f"Cannot pre-extract {name}, its archive is not downloaded.")
+            continue
+        extracted_dir = os.path.join(cache_dir, 'extracted', entry['sha256'])
+        if os.path.isdir(extracted_dir):
+            continue
+        log_info(f"Extracting {tool['name']} on the host...")
+        tmp_dir = extracted_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
         try:
-            print(f"[*] Downloading {tool_name}...")
-            response = requests.get(tool_link, stream=True, allow_redirects=True, timeout=30)
-            response.raise_for_status()
-            
-            with open(destination, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"[+] {tool_name} downloaded successfully")
-            
-        except requests.RequestException as e:
-            print(f"[-] Failed to download {tool_name}: {e}")
+            _extract_archive(_object_path(cache_dir, entry['sha256']), tool['name'], tmp_dir)
         except Exception as e:
-            print(f"[-] Error downloading {tool_name}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            log_error(f"Failed to extract {tool['name']}, it will be extracted in the sandbox: {e}")
+            continue
+        os.replace(tmp_dir, extracted_dir)
+        log_success(f"{tool['name']} extracted to {extracted_dir}")
+    return get_prebuilt_tools(config)
+
+def _wheelhouse_spec(tool: dict) -> dict:
+    """Return what a pip tool's wheelhouse is built from, or None for other tools."""
+    recipe = tool.get('install') or {}
+    if recipe.get('type') != 'pip' or not recipe.get('packages'):
+        return None
+    return {
+        'packages': list(recipe['packages']),
+        'python': recipe.get('python', DEFAULT_WHEEL_PYTHON),
+        'platform': recipe.get('platform', DEFAULT_WHEEL_PLATFORM),
+    }
 
-def generate_wsb_config(config: dict) -> str:
-    """Generate a WSB configuration string based on the provided vmConfig section."""
-    vm_config = config.get("vmConfig", {})
-    tools_config = config.get("tools", {})
+def _wheelhouse_key(spec: dict) -> str:
+    """Version a wheelhouse by its packages and target interpreter."""
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
 
-    xml_lines = ['<Configuration>']
+def get_wheelhouses(config: dict) -> dict:
+    """Map each enabled pip tool whose wheelhouse is built to its folder on the host."""
+    wheelhouses = {}
+    for name, tool in config.get('tools', {}).items():
+        spec = _wheelhouse_spec(tool) if tool.get('enable', False) else None
+        if spec is None:
+            continue
+        folder = os.path.join(SETUPS_DIR, WHEELHOUSE_FOLDER, _wheelhouse_key(spec))
+        if os.path.isfile(os.path.join(folder, 'wheelhouse.json')):
+            wheelhouses[name] = folder
+    return wheelhouses
+
+def prepare_wheelhouses(config: dict, refresh: bool = False) -> dict:
+    """Download the wheels of every enabled pip tool once on the host, for an offline install.
+
+    Each wheelhouse lands in scripts/setups/wheels/<key>, keyed by its packages and target
+    Python, and is only used once complete. With refresh, the ones on "latest" are rebuilt.
+    A tool whose wheels cannot all be fetched keeps installing from PyPI in the sandbox."""
+    for name, tool in config.get('tools', {}).items():
+        spec = _wheelhouse_spec(tool) if tool.get('enable', False) else None
+        if spec is None:
+            continue
+        folder = os.path.join(SETUPS_DIR, WHEELHOUSE_FOLDER, _wheelhouse_key(spec))
+        if os.path.isfile(os.path.join(folder, 'wheelhouse.json')) and not (refresh and tool.get('version') == 'latest'):
+            continue
+        log_info(f"Building the wheelhouse of {name}...")
+        tmp_dir = folder + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        command = [
+            sys.executable, '-m', 'pip', 'download', '--quiet', '--dest', tmp_dir,
+            '--only-binary=:all:', '--platform', spec['platform'],
+            '--python-version', spec['python'], '--implementation', 'cp',
+        ] + spec['packages']
+        try:
+            subprocess.run(command, check=True, capture_output=True, text=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            detail = (getattr(e, 'stderr', None) or str(e)).strip().splitlines()
+            log_error(f"Failed to build the wheelhouse of {name}, it will be installed from PyPI in the sandbox: {detail[-1] if detail else e}")
+            continue
+        files = sorted(os.listdir(tmp_dir))
+        with open(os.path.join(tmp_dir, 'wheelhouse.json'), 'w') as file:
+            json.dump(dict(spec, files=files, built=time.time()), file, indent=4)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp_dir, folder)
+        log_success(f"Wheelhouse of {name} built with {len(files)} wheels in {folder}", tool=name, wheels=len(files))
+    return get_wheelhouses(config)
+
+def generate_wsb_config(config: dict, output_path: str = None, profile_dir: str = None) -> str:
+    """Generate a WSB configuration string based on the provided vmConfig section.
+
+    For a named profile, profile_dir (holding its setup.cmd and start.cmd) is mapped
+    into the sandbox and used as the logon command instead of scripts/start.cmd.
+    The file records a fingerprint of its inputs and is neither rendered nor rewritten
+    while they stay the same. Returns the path of the .wsb file."""
+    vm_config = dict(config.get("vmConfig", {}))
+    if profile_dir:
+        vm_config["LogonCommand"] = f"{PROFILE_SANDBOX_FOLDER}\\start.cmd"
+    wsb_path = output_path or os.path.join(os.path.dirname(__file__), 'WinSandbox.wsb')
+    log_dir = get_boot_log_dir(config) if get_profiling_config(config)['enable'] else None
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    prebuilt = get_prebuilt_tools(config)
+
+    # Nothing to do when the file was already rendered from the same inputs
+    fingerprint = _fingerprint('wsb', {
+        'vmConfig': vm_config,
+        'scripts': os.path.abspath(os.path.dirname(__file__)),
+        'profileDir': os.path.abspath(profile_dir) if profile_dir else None,
+        'logDir': os.path.abspath(log_dir) if log_dir else None,
+        'prebuilt': prebuilt,
+    })
+    if _stored_fingerprint(wsb_path) == fingerprint:
+        log_info(f"WSB file is up to date: {wsb_path}")
+        return wsb_path
+
+    xml_lines = ['<Configuration>', f'  <!-- sandbox-auto-setup fingerprint {fingerprint} -->']
 
     # Basic options
     if "vGPU" in vm_config:
@@ -160,7 +1995,32 @@ def generate_wsb_config(config: dict) -> str:
         "SandboxFolder": "C:\\Users\\WDAGUtilityAccount\\Desktop\\scripts",
             "ReadOnly": "true"
         })
-    print(f"[*] Added default tools folder: {host_folder}")
+    log_debug(f"Added default tools folder: {host_folder}")
+
+    if profile_dir:
+        mapped_folders.append({
+            "HostFolder": os.path.abspath(profile_dir),
+            "SandboxFolder": PROFILE_SANDBOX_FOLDER,
+            "ReadOnly": "true"
+        })
+
+    # The instrumented setup.cmd writes its boot timings back to the host
+    if log_dir:
+        mapped_folders.append({
+            "HostFolder": os.path.abspath(log_dir),
+            "SandboxFolder": BOOT_LOG_SANDBOX_FOLDER,
+            "ReadOnly": "false"
+        })
+        log_debug(f"Added boot log folder: {log_dir}")
+
+    # Archives extracted on the host are used in place
+    for tool_name, folder in prebuilt.items():
+        mapped_folders.append({
+            "HostFolder": folder["HostFolder"],
+            "SandboxFolder": folder["SandboxFolder"],
+            "ReadOnly": "true"
+        })
+        log_debug(f"Added pre-extracted folder for {tool_name}: {folder['HostFolder']}")
 
     # Add user-defined mapped folders
     for folder in vm_config.get("MappedFolder", []):
@@ -194,13 +2054,21 @@ def generate_wsb_config(config: dict) -> str:
 
     xml_lines.append('</Configuration>')
 
-    # Write to file
-    wsb_path = os.path.join(os.path.dirname(__file__), 'WinSandbox.wsb')
-    with open(wsb_path, 'w') as file:
-        file.write("\n".join(xml_lines))
+    # Write to file, only when its content differs
+    if write_if_changed(wsb_path, "\n".join(xml_lines)):
+        log_success(f"WSB file written to: {wsb_path}")
+    else:
+        log_info(f"WSB file is up to date: {wsb_path}")
+    return wsb_path
 
-    print(f"[+] WSB file written to: {wsb_path}")
 
+def _report_downloads(results: list):
+    """Say whether every required setup file is now present, or which ones could not be downloaded."""
+    failed = [result['name'] for result in results if not result['ok']]
+    if failed:
+        log_warning(f"{len(failed)} setup files could not be downloaded: {', '.join(failed)}", failed=failed)
+    else:
+        log_success("All required setup files are present.")
 
 def tool_config():
     """Show the configuration, with index numbers to toggle tools using numbers.
@@ -216,30 +2084,25 @@ def tool_config():
 
         choice = input("\nEnter the number of the tool to toggle, or 'done' to finish: ").strip()
         if choice.lower() == 'done':
-            print("[*] Checking for missing setup files...")
-            missing_files = get_missing_setup_files(config)
-
-            if missing_files:
-                download_missing_setup_files(config)
-            print("[+] All setup files are present. Proceeding with the setup script.")
-            generate_wsb_config(config)
+            log_info("Checking for missing setup files...")
+            _report_downloads(download_missing_setup_files(config))
             break
         try:
             index = int(choice) - 1
             tool_name = list(config['tools'].keys())[index]
             config = toggle_tool(config, tool_name)
         except (ValueError, IndexError):
-            print("[-] Invalid input. Please enter a valid number.")
+            log_error("Invalid input. Please enter a valid number.")
 
 def sandbox_config():
     """Show the current VM configuration and allow the user to modify it."""
     config = get_config()
     vm_config = config.get('vmConfig', {})
-    print("[*] Current VM Configuration:")
+    log_info("Current VM Configuration:")
     for key, value in vm_config.items():
         print(f"{key}: {value}")
 
-    print("\n[*] Enter new values for the VM configuration (leave blank to keep current value):")
+    log_info("Enter new values for the VM configuration (leave blank to keep current value):")
 
     for key in list(vm_config.keys()):
         if key == "MappedFolder":
@@ -257,7 +2120,8 @@ def sandbox_config():
                     "SandboxFolder": sandbox_folder,
                     "ReadOnly": read_only
                 })
-                print("[+] Mapped folder added.")
+                mark_config_dirty('vmConfig', 'MappedFolder')
+                log_success("Mapped folder added.")
 
             elif action == 'remove':
                 mapped = vm_config.get("MappedFolder", [])
@@ -272,34 +2136,36 @@ def sandbox_config():
                             idx = int(index) - 1
                             if 0 <= idx < len(mapped):
                                 del mapped[idx]
-                                print("[+] Folder removed.")
+                                mark_config_dirty('vmConfig', 'MappedFolder')
+                                log_success("Folder removed.")
                             else:
-                                print("[-] Invalid index.")
+                                log_error("Invalid index.")
                     except ValueError:
-                        print("[-] Invalid input.")
+                        log_error("Invalid input.")
                 else:
-                    print("[!] No mapped folders to remove.")
+                    log_warning("No mapped folders to remove.")
         elif key == "LogonCommand":
             continue
         else:
             new_value = input(f"{key} (current: {vm_config[key]}): ").strip()
-            if new_value:
+            if new_value and new_value != vm_config[key]:
                 vm_config[key] = new_value
+                mark_config_dirty('vmConfig', key)
 
     # Ensure LogonCommand is correctly set
     tools_cmd_path = r"C:\Users\WDAGUtilityAccount\Desktop\scripts\start.cmd"
     if "LogonCommand" not in vm_config or vm_config["LogonCommand"] != tools_cmd_path:
-        print("[*] Setting LogonCommand to launch tools setup script.")
+        log_info("Setting LogonCommand to launch tools setup script.")
         vm_config["LogonCommand"] = tools_cmd_path
+        mark_config_dirty('vmConfig', 'LogonCommand')
 
-    print("\n[*] Final VM Configuration:")
+    log_info("Final VM Configuration:")
     for key, value in vm_config.items():
         print(f"{key}: {value}")
 
     config["vmConfig"] = vm_config
-    save_config(config)
     generate_wsb_config(config)
-    print("[+] VM configuration updated and WSB file regenerated.")
+    log_success("VM configuration updated and WSB file regenerated.")
 
 
 
@@ -310,11 +2176,12 @@ def configure_sandbox():
         tools = config.get('tools', {})
         enabled_tools_list = [name for name, info in tools.items() if info.get('enable')]
         vm_config = config.get('vmConfig', {})
-        print("[*] Current configuration:")
-        print(f"[*] - Available tools: {', '.join(tools.keys())}")
-        print(f"[*] - Enabled tools: {', '.join(enabled_tools_list)}")
-        print(f"[*] - VM Configuration: \n\n{json.dumps(vm_config, indent=4)}")
+        log_info("Current configuration:")
+        log_info(f"- Available tools: {', '.join(tools.keys())}", tools=list(tools))
+        log_info(f"- Enabled tools: {', '.join(enabled_tools_list)}", enabled=enabled_tools_list)
+        log_info(f"- VM Configuration: \n\n{json.dumps(vm_config, indent=4)}", vmConfig=vm_config)
         print(f"[*] To change tools configuration enter 'tool' or 'vm' to change VM configuration.")
+        print("[*] Type 'update' to re-download installers that changed upstream.")
         print("[*] Type 'done' to finish configuration and generate the WSB file.")
         print("[*] Type 'exit' to quit the configuration.")
         choice = input("Choice: ").strip().lower()
@@ -322,117 +2189,322 @@ def configure_sandbox():
             tool_config()
         elif choice == 'vm':
             sandbox_config()
+        elif choice == 'update':
+            update_setup_files(config)
         elif choice == 'done':
-            file_path = os.path.join(os.path.dirname(__file__), 'scripts', 'setups')
-            # Check if 7-Zip is installed, if not, download it
-            if not os.path.exists(os.path.join(file_path, '7z2409-x64.msi')):
-                download_7zip()
-
-            print("[*] Checking for missing setup files...")
-            missing_files = get_missing_setup_files(config)
-            if missing_files:
-                print(f"[*] Downloading {len(missing_files)} missing files...")
-                download_missing_setup_files(config)
-            else:
-                print("[+] All required setup files are present.")
+            # 7-Zip and every missing tool are fetched in a single concurrent batch
+            log_info("Checking for missing setup files...")
+            _report_downloads(download_missing_setup_files(config))
+            prepare_extracted_tools(config)
+            prepare_wheelhouses(config)
 
-            print("[*] Generating WSB configuration file...")
-            generate_wsb_config(config)
-            print("[+] WSB configuration file generated successfully.")
+            log_info("Generating WSB configuration file...")
+            available = exclude_unavailable_tools(config)
+            generate_wsb_config(available)
+            generate_setup_cmd(available)
+            log_success("WSB configuration file generated successfully.")
+            save_config(config)
             break
         elif choice == 'exit':
-            print("[*] Exiting configuration.")
+            log_info("Exiting configuration.")
+            save_config(config)
             sys.exit(0)
 
-def generate_setup_cmd(config: json):
-    """Generate a setup.cmd file that installs only the enabled tools."""
+def _exe_recipe(recipe: dict) -> list:
+    """Run an installer executable with its silent flags."""
+    return [f'"{{installer}}" {recipe.get("args", "")}'.rstrip()]
+
+def _msi_recipe(recipe: dict) -> list:
+    """Install an MSI package quietly with msiexec."""
+    return [f'msiexec /i "{{installer}}" {recipe.get("args", "/qn /norestart")}'.rstrip()]
+
+def _archive_recipe(recipe: dict) -> list:
+    """Extract an archive with 7-Zip into its target folder.
+
+    With a subfolder, only that folder of the archive is kept as the target."""
+    seven_zip = '"%PROGRAMFILES%\\7-Zip\\7z.exe"'
+    subfolder = recipe.get("subfolder")
+    if not subfolder:
+        return [
+            'if not exist "{target}" mkdir "{target}"',
+            f'{seven_zip} x -aoa "{{installer}}" -o"{{target}}"',
+        ]
+    parent, _, leaf = recipe["target"].rpartition("\\")
+    if leaf.lower() == subfolder.lower():
+        return [f'{seven_zip} x -aoa "{{installer}}" -o"{parent}" "{subfolder}\\*"']
+    staging = '%TEMP%\\' + _cmd_safe(subfolder.replace('\\', '_')) + '_extract'
+    return [
+        f'{seven_zip} x -aoa "{{installer}}" -o"{staging}" "{subfolder}\\*"',
+        f'xcopy /E /I /Y /Q "{staging}\\{subfolder}" "{{target}}"',
+        f'rmdir /s /q "{staging}"',
+    ]
+
+def _pip_recipe(recipe: dict) -> list:
+    """Install Python packages with pip, which needs Python in an earlier level."""
+    return [f'pip install -U {" ".join(recipe.get("packages", []))}']
+
+def _pip_offline_recipe(recipe: dict) -> list:
+    """Install Python packages from the wheelhouse built on the host, without network access."""
+    spec = _wheelhouse_spec({"install": recipe})
+    if spec is None:
+        return None
+    wheelhouse = f'%SETUP_PATH%\\{WHEELHOUSE_FOLDER}\\{_wheelhouse_key(spec)}'
+    return [f'pip install --no-index --find-links "{wheelhouse}" {" ".join(spec["packages"])}']
+
+def _command_recipe(recipe: dict) -> list:
+    """No installer: the tool is set up entirely by its "post" commands."""
+    return []
+
+# Install recipe types usable in a tool's "install" block: type -> renderer of its install commands.
+# Every recipe also accepts "path" (folders added to PATH) and "post" (commands run afterwards);
+# "{installer}" and "{target}" in commands are replaced with the installer and target folder.
+INSTALL_RECIPES = {
+    "exe": _exe_recipe,
+    "msi": _msi_recipe,
+    "archive": _archive_recipe,
+    "pip": _pip_recipe,
+    "command": _command_recipe,
+}
+
+def _default_recipe(tool: dict) -> dict:
+    """Infer a recipe for a tool without an "install" block from its file extension, or None."""
+    filename = tool.get("name", "")
+    lowered = filename.lower()
+    if lowered.endswith(".msi"):
+        return {"type": "msi"}
+    if lowered.endswith((".zip", ".7z")):
+        return {"type": "archive", "target": f'{DEFAULT_ARCHIVE_FOLDER}\\{filename.rsplit(".", 1)[0]}'}
+    return None
+
+def compile_recipe(name: str, tool: dict) -> dict:
+    """Resolve a tool's install recipe once into command templates, PATH entries and target folder."""
+    recipe = tool.get("install") or _default_recipe(tool)
+    if recipe is None:
+        log_warning(f"{name} has no install recipe, add an \"install\" block to its configuration.")
+        return {
+            "type": None,
+            "install": [f'echo [!] No install recipe for {name}'],
+            "post": [],
+            "paths": [],
+            "target": None,
+            "subfolder": "",
+            "offline": None,
+        }
+    return {
+        "type": recipe["type"],
+        "install": INSTALL_RECIPES[recipe["type"]](recipe),
+        "post": list(recipe.get("post", [])),
+        "paths": list(recipe.get("path", [])),
+        "target": recipe.get("target"),
+        "subfolder": recipe.get("subfolder", ""),
+        "offline": _pip_offline_recipe(recipe) if recipe["type"] == "pip" else None,
+    }
+
+# 7-Zip is not part of the tool catalog but installs like any MSI tool
+SEVEN_ZIP_TOOL = {"name": SEVEN_ZIP_NAME, "install": {"type": "msi"}}
+SEVEN_ZIP_RECIPE = compile_recipe(SEVEN_ZIP_STEP, SEVEN_ZIP_TOOL)
+
+def get_install_recipes(config: json) -> dict:
+    """Return the compiled install recipe of every tool, compiling them only once per tool catalog."""
+    tools = config.get('tools', {})
+    cached = _install_recipes.get(id(tools))
+    if cached is None or cached[0] is not tools:
+        cached = (tools, {name: compile_recipe(name, tool) for name, tool in tools.items()})
+        _install_recipes[id(tools)] = cached
+    return cached[1]
+
+def _tool_install_steps(recipe: dict, tool: dict, prebuilt: dict = None, offline: bool = False) -> tuple:
+    """Return the commands that install a tool from its compiled recipe and the PATH entries it adds.
+
+    Installers run straight from the read-only mapped setups folder. A tool with
+    "copyLocal" set copies only its own installer to %TEMP% first, inside its step.
+    Archives pre-extracted on the host (prebuilt) are already mapped in place, and
+    pip tools with a built wheelhouse (offline) install from it."""
+    commands = []
+    installer = f'%SETUP_PATH%\\{tool.get("name", "")}'
+    copy_local = tool.get("copyLocal", False) and not prebuilt
+    if copy_local:
+        commands.append(f'copy /B /Y "{installer}" "%TEMP%\\"')
+        installer = f'%TEMP%\\{tool.get("name", "")}'
+
+    target = prebuilt["SandboxFolder"] if prebuilt else recipe["target"] or ""
+    if prebuilt:
+        commands.append(f'echo [*] {tool.get("name", "")} is mapped from the host.')
+        templates = recipe["post"]
+    elif offline and recipe["offline"]:
+        templates = recipe["offline"] + recipe["post"]
+    else:
+        templates = recipe["install"] + recipe["post"]
+    commands += [line.replace("{installer}", installer).replace("{target}", target) for line in templates]
+
+    if copy_local:
+        commands.append(f'del /Q "{installer}"')
+    return commands, list(recipe["paths"])
+
+def _install_levels(config: dict, prebuilt: dict = None) -> list:
+    """Group the enabled tools, plus 7-Zip, into levels that only depend on earlier levels.
+
+    Tools inside one level are independent of each other and can be installed concurrently.
+    7-Zip is left out when the configuration says its installer is unavailable ("sevenZip": false)."""
+    tools = config.get("tools", {})
+    graph = get_dependency_graph(config)
+    recipes = get_install_recipes(config)
+    for cycle in graph['cycles']:
+        if any(tools[name].get("enable", False) for name in cycle):
+            log_warning(f"circular dependency between {', '.join(cycle)}, ignoring the edges between them.")
+
+    seven_zip = config.get("sevenZip", True)
+    level_of = {SEVEN_ZIP_STEP: 0} if seven_zip else {}
+    dependencies = {SEVEN_ZIP_STEP: []} if seven_zip else {}
+    # The graph order puts dependencies first, so each level is known when its dependents are reached
+    for name in graph['order']:
+        tool = tools[name]
+        if not tool.get("enable", False):
+            continue
+        deps = []
+        for dep in tool.get('dependencies', []):
+            if dep in graph['component'][name]:
+                continue
+            if dep in level_of:
+                deps.append(dep)
+            else:
+                log_warning(f"{name} depends on {dep}, which is not enabled.")
+        # Archives are extracted with 7-Zip inside the sandbox, unless they were extracted on the host
+        if recipes[name]["type"] == "archive" and name not in (prebuilt or {}) and seven_zip:
+            deps.append(SEVEN_ZIP_STEP)
+        dependencies[name] = deps
+        level_of[name] = max((level_of[dep] + 1 for dep in deps), default=0)
+
+    levels = [[] for _ in range(max(level_of.values(), default=-1) + 1)]
+    for name in ([SEVEN_ZIP_STEP] if seven_zip else []) + [name for name in tools if name in level_of]:
+        levels[level_of[name]].append((name, dependencies[name]))
+    return levels
+
+def _render_install_step(step_id: str, commands: list, timing: dict = None) -> list:
+    """Render the label a background worker runs to install one tool.
+
+    The step records its exit code in %STATUS_DIR% and retries while another
+    Windows Installer transaction holds the install mutex (exit code 1618).
+    With timing (the tool name and level), its start, end and exit code are
+    also logged to %RUN_LOG% for the boot report."""
+    lines = [f':{step_id}']
+    if timing:
+        lines.append('call :stamp STEP_START')
+    lines += [
+        'set "STEP_TRY=0"',
+        f':{step_id}_run',
+        'set "STEP_RC=0"',
+    ]
+    for command in commands:
+        if command.startswith('echo '):
+            lines.append(command)
+        else:
+            lines.append(f'{command} || call set "STEP_RC=%%ERRORLEVEL%%"')
+    lines += [
+        f'if not "%STEP_RC%"=="1618" goto {step_id}_end',
+        'set /a STEP_TRY+=1',
+        f'if %STEP_TRY% GEQ {MSI_BUSY_RETRIES} goto {step_id}_end',
+        'echo [*] Another installation is in progress, retrying...',
+        'timeout /t 5 /nobreak >nul',
+        f'goto {step_id}_run',
+        f':{step_id}_end',
+    ]
+    if timing:
+        lines += [
+            'call :stamp STEP_END',
+            f'call :record_step {step_id} {timing["level"]} %STEP_START% %STEP_END% %STEP_RC% "{_cmd_safe(timing["name"])}"',
+        ]
+    lines += [
+        f'if "%STEP_RC%"=="0" (>"%STATUS_DIR%\\{step_id}.ok" echo 0) else (>"%STATUS_DIR%\\{step_id}.failed" echo %STEP_RC%)',
+        f'>"%STATUS_DIR%\\{step_id}.done" echo done',
+        'exit /b %STEP_RC%',
+        '',
+    ]
+    return lines
+
+def _cmd_safe(text: str) -> str:
+    """Drop the characters cmd.exe would interpret from a value echoed into a log."""
+    return ''.join(char for char in text if char not in '&|<>^%"')
+
+def generate_setup_cmd(config: json, instrument: bool = None, output_path: str = None) -> str:
+    """Generate a setup.cmd file that installs only the enabled tools.
+
+    Tools are grouped into dependency levels. Every tool of a level is installed by a
+    background worker, and the next level starts once the whole level has finished.
+    A tool whose prerequisite failed is skipped. An instrumented script (profilingConfig.enable
+    by default) logs the start, end and exit code of every step to the mapped boot log folder.
+    Like the .wsb, the script is skipped while the fingerprint of its inputs is unchanged."""
     tools = config.get("tools", {})
-    setup_path = r"%SETUP_PATH%"
+    prebuilt = get_prebuilt_tools(config)
+    wheelhouses = get_wheelhouses(config)
+    if instrument is None:
+        instrument = get_profiling_config(config)['enable']
+    start_cmd_path = output_path or os.path.join(os.path.dirname(__file__), "scripts", "setup.cmd")
+
+    # Nothing to do when the script was already rendered from the same inputs
+    fingerprint = _fingerprint('setup.cmd', {
+        'tools': {name: [tool.get(key) for key in ('enable', 'name', 'install', 'copyLocal', 'dependencies')]
+                  for name, tool in tools.items()},
+        'instrument': instrument,
+        'prebuilt': prebuilt,
+        'wheelhouses': sorted(wheelhouses),
+        'sevenZip': config.get('sevenZip', True),
+    })
+    if _stored_fingerprint(start_cmd_path) == fingerprint:
+        log_info(f"setup.cmd is up to date: {start_cmd_path}")
+        return start_cmd_path
+
+    recipes = get_install_recipes(config)
     lines = [
         "@echo off",
+        f"rem sandbox-auto-setup fingerprint {fingerprint}",
+        "rem Background install steps re-enter this script with the label to run",
+        'if not "%~1"=="" goto %~1',
         "set SETUP_PATH=C:\\users\\WDAGUtilityAccount\\Desktop\\scripts\\setups",
-        "echo [*] Copying setup files...",
-        "copy /B /Y /V %SETUP_PATH%\\* %TEMP%\\",
-        ""
+        'set "STATUS_DIR=%TEMP%\\sandbox-setup"',
+        'if exist "%STATUS_DIR%" rmdir /s /q "%STATUS_DIR%"',
+        'mkdir "%STATUS_DIR%"',
     ]
-    lines.append(f'msiexec /i "%TEMP%\\7z2409-x64.msi" /qn /norestart')
+    if instrument:
+        lines += [
+            'set "RUN_ID=%COMPUTERNAME%-%RANDOM%%RANDOM%"',
+            f'set "RUN_LOG={BOOT_LOG_SANDBOX_FOLDER}\\%RUN_ID%"',
+            'mkdir "%RUN_LOG%"',
+            'call :stamp BOOT_START',
+            '>"%RUN_LOG%\\run.txt" echo date=%DATE%',
+            '>>"%RUN_LOG%\\run.txt" echo start=%BOOT_START%',
+        ]
+    lines.append("")
 
-    # Get enabled tools and sort by dependencies
-    enabled_tools = [(name, tool) for name, tool in tools.items() if tool.get("enable", False)]
-    
-    # Sort tools so dependencies are installed first
-    def dependency_sort_key(tool_item):
-        name, tool = tool_item
-        deps = tool.get('dependencies', [])
-        return len(deps)  # Tools with fewer dependencies first
-    
-    enabled_tools.sort(key=dependency_sort_key)
-
-    for name, tool in enabled_tools:
-        filename = tool.get("name", "").lower()
-        lines.append(f'echo [*] Installing {name}...')
+    step_ids = {}
+    step_lines = []
+    summary_lines = []
+    for index, level in enumerate(_install_levels(config, prebuilt), start=1):
+        lines.append(f'echo [*] Installing level {index}: {", ".join(name for name, _ in level)}...')
+        level_paths = []
+        for name, dependencies in level:
+            step_id = step_ids[name] = f"step_{len(step_ids) + 1}"
+            tool = SEVEN_ZIP_TOOL if name == SEVEN_ZIP_STEP else tools[name]
+            recipe = SEVEN_ZIP_RECIPE if name == SEVEN_ZIP_STEP else recipes[name]
+            commands, paths = _tool_install_steps(recipe, tool, prebuilt.get(name), name in wheelhouses)
+            level_paths += paths
+            step_lines += _render_install_step(step_id, commands, {'name': name, 'level': index} if instrument else None)
+            summary_lines.append(f'if exist "%STATUS_DIR%\\{step_id}.failed" echo [-] {name} failed, see "%STATUS_DIR%\\{step_id}.log"')
 
-        # Custom behavior per tool
-        try:
-            if "jpegview" in filename:
-                lines += [
-                    'if not exist "C:\\Program Files\\JPEGView64" mkdir "C:\\Program Files\\JPEGView64"',
-                    f'"%PROGRAMFILES%\\7-Zip\\7z.exe" x -aoa "%TEMP%\\{filename}" -o"C:\\Program Files" JPEGView64\\*',
-                    'assoc .jpg=JPEGView.Image',
-                    'assoc .png=JPEGView.Image',
-                    'ftype JPEGView.Image="C:\\Program Files\\JPEGView64\\JPEGView64.exe" "%%1"'
-                ]
-
-            if "git" in filename:
-                lines += [
-                    f'"%TEMP%\\{filename}" /VERYSILENT /NORESTART /NOCANCEL /SP-',
-                    'set "PATH=%PATH%;C:\\Program Files\\Git\\cmd"'
-                ]
-
-            if "python-3" in filename:
-                lines += [
-                    f'"%TEMP%\\{filename}" /quiet InstallAllUsers=1 PrependPath=1 Include_test=0',
-                    'set "PATH=%PATH%;C:\\Program Files\\Python312\\Scripts\\"',
-                    'set "PATH=%PATH%;C:\\Program Files\\Python312\\"'
-                ]
-
-            if "python-2" in filename:
-                lines.append(f'msiexec /i "%TEMP%\\{filename}" /qn /norestart')
-
-            if "oletools" in name.lower():
-                lines += [
-                    'pip install -U oletools[full]',
-                    'echo "[*] oletools installed successfully."'
-                ]
-
-            if "vscode" in filename:
-                lines.append(f'"%TEMP%\\{filename}" /verysilent /suppressmsgboxes /MERGETASKS="!runcode,addtopath"')
-
-            if "dotnet-sdk" in filename:
-                lines += [
-                    f'"%TEMP%\\{filename}" /quiet /norestart',
-                    'echo "[*] .NET SDK installed successfully"',
-                    'echo "[*] Adding .NET to PATH..."',
-                    'set "PATH=%PATH%;C:\\Program Files\\dotnet\\"'
-                ]
-
-            if "sysinternals" in filename:
-                lines.append(f'"%PROGRAMFILES%\\7-Zip\\7z.exe" x -aoa "%TEMP%\\{filename}" -o"%USERPROFILE%\\Desktop\\Tools\\sysinternals"')
-
-            if "zimmermantools" in filename or "get-zimmermantools" in filename:
-                lines += [
-                    'if not exist "%USERPROFILE%\\Desktop\\Tools\\ZimmermanTools" mkdir "%USERPROFILE%\\Desktop\\Tools\\ZimmermanTools"',
-                    f'"%PROGRAMFILES%\\7-Zip\\7z.exe" x -aoa "%TEMP%\\{filename}" -o"%USERPROFILE%\\Desktop\\Tools\\ZimmermanTools"',
-                    'echo "[*] Eric Zimmerman Tools extracted to Desktop\\Tools\\ZimmermanTools"',
-                    'cd /d "%USERPROFILE%\\Desktop\\Tools\\ZimmermanTools"',
-                    'powershell.exe -ExecutionPolicy Bypass -File "Get-ZimmermanTools.ps1" -Dest "%USERPROFILE%\\Desktop\\Tools\\ZimmermanTools\\EZTools"',
-                    'echo "[*] Eric Zimmerman Tools downloaded and installed successfully"'
-                ]
-
-        except Exception as e:
-            lines.append(f'echo [!] Unknown install method for: {filename}')
+            start_line = f'start "{name}" /b cmd /c call "%~f0" :{step_id} >"%STATUS_DIR%\\{step_id}.log" 2>&1'
+            if dependencies:
+                lines.append('set "STEP_BLOCKED="')
+                for dependency in dependencies:
+                    lines.append(f'if exist "%STATUS_DIR%\\{step_ids[dependency]}.failed" set "STEP_BLOCKED=1"')
+                lines.append(f'if defined STEP_BLOCKED (call :skip_step {step_id} "{name}" {index}) else {start_line}')
+            else:
+                lines.append(start_line)
 
-        lines.append("")  # add empty line for readability
+        lines.append(f'call :wait_for {" ".join(step_ids[name] for name, _ in level)}')
+        # PATH changes made by a background worker are lost, so they are applied here for the next levels
+        for path in level_paths:
+            lines.append(f'set "PATH=%PATH%;{path}"')
+        lines.append("")
 
     # Add hardcoded options like ScriptBlockLogging
     lines += [
@@ -440,70 +2512,367 @@ def generate_setup_cmd(config: json):
         "powershell.exe -Command \"New-Item -Path HKLM:\\SOFTWARE\\Wow6432Node\\Policies\\Microsoft\\Windows\\PowerShell\\ScriptBlockLogging -Force\"",
         "powershell.exe -Command \"Set-ItemProperty -Path HKLM:\\SOFTWARE\\Wow6432Node\\Policies\\Microsoft\\Windows\\PowerShell\\ScriptBlockLogging -Name EnableScriptBlockLogging -Value 1 -Force\"",
         "",
+    ]
+    if instrument:
+        lines += [
+            'call :stamp BOOT_END',
+            '>>"%RUN_LOG%\\run.txt" echo end=%BOOT_END%',
+            'echo [*] Boot timings written to %RUN_LOG%',
+        ]
+    lines += summary_lines
+    lines += [
         "echo [*] All tasks completed.",
-        "pause"
+        "pause",
+        "exit /b 0",
+        "",
+        ":wait_for",
+        'if "%~1"=="" exit /b 0',
+        'if not exist "%STATUS_DIR%\\%~1.done" (',
+        '    timeout /t 1 /nobreak >nul',
+        '    goto wait_for',
+        ')',
+        'shift',
+        'goto wait_for',
+        "",
+        ":skip_step",
+        'echo [-] Skipping %~2, a prerequisite failed.',
+        '>"%STATUS_DIR%\\%~1.failed" echo skipped',
+    ]
+    if instrument:
+        lines += [
+            'call :stamp SKIP_AT',
+            'call :record_step %~1 %~3 %SKIP_AT% %SKIP_AT% skipped %2',
+        ]
+    lines += [
+        '>"%STATUS_DIR%\\%~1.done" echo done',
+        'exit /b 0',
+        "",
     ]
+    if instrument:
+        lines += [
+            "rem Centiseconds since midnight, from the locale independent parts of %TIME%",
+            ":stamp",
+            'for /f "tokens=1-4 delims=:.," %%a in ("%TIME: =0%") do set /a "%~1=(((1%%a-100)*60+1%%b-100)*60+1%%c-100)*100+1%%d-100"',
+            'exit /b 0',
+            "",
+            ":record_step",
+            '>"%RUN_LOG%\\%~1.txt" echo level=%~2',
+            '>>"%RUN_LOG%\\%~1.txt" echo start=%~3',
+            '>>"%RUN_LOG%\\%~1.txt" echo end=%~4',
+            '>>"%RUN_LOG%\\%~1.txt" echo rc=%~5',
+            '>>"%RUN_LOG%\\%~1.txt" echo name=%~6',
+            'exit /b 0',
+            "",
+        ]
+    lines += step_lines
+
+    # Write to scripts/setup.cmd, only when its content differs
+    if write_if_changed(start_cmd_path, "\n".join(lines)):
+        log_success(f"setup.cmd generated with {sum(tool.get('enable', False) for tool in tools.values())} tools.")
+    else:
+        log_info(f"setup.cmd is up to date: {start_cmd_path}")
+    return start_cmd_path
+
+def _read_key_values(path: str) -> dict:
+    """Read a key=value file written by the instrumented setup.cmd."""
+    values = {}
+    with open(path, 'r', errors='replace') as file:
+        for line in file:
+            key, _, value = line.strip().partition('=')
+            if key:
+                values[key] = value.strip()
+    return values
+
+def _elapsed_seconds(start: str, end: str) -> float:
+    """Return the seconds between two centisecond stamps, allowing for one midnight rollover."""
+    elapsed = int(end) - int(start)
+    if elapsed < 0:
+        elapsed += 24 * 60 * 60 * 100
+    return elapsed / 100
 
-    # Write to scripts/setup.cmd
-    start_cmd_path = os.path.join(os.path.dirname(__file__), "scripts", "setup.cmd")
-    with open(start_cmd_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+def _percentile(values: list, percent: float) -> float:
+    """Return the nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    rank = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[rank]
 
-    print(f"[+] setup.cmd generated with {sum(tool['enable'] for tool in tools.values())} tools.")
+def load_boot_runs(config: dict) -> list:
+    """Load every boot run logged by instrumented setup.cmd scripts, oldest first."""
+    log_dir = get_boot_log_dir(config)
+    if not os.path.isdir(log_dir):
+        return []
+    runs = []
+    for entry in os.scandir(log_dir):
+        run_file = os.path.join(entry.path, 'run.txt')
+        if not entry.is_dir() or not os.path.isfile(run_file):
+            continue
+        run = _read_key_values(run_file)
+        run['id'] = entry.name
+        run['mtime'] = entry.stat().st_mtime
+        run['steps'] = []
+        for step_file in os.scandir(entry.path):
+            if step_file.name.startswith('step_') and step_file.name.endswith('.txt'):
+                step = _read_key_values(step_file.path)
+                if 'start' in step and 'end' in step:
+                    step['seconds'] = _elapsed_seconds(step['start'], step['end'])
+                    run['steps'].append(step)
+        runs.append(run)
+    runs.sort(key=lambda run: run['mtime'])
+    return runs
+
+def boot_report(config: dict, output: str = 'text') -> dict:
+    """Print per-tool p50/p95 install times, failures and the critical path across logged boots.
+
+    With output 'json' the report is printed as one JSON document instead of a table."""
+    runs = load_boot_runs(config)
+    if not runs:
+        log_error(f"No boot logs found in {get_boot_log_dir(config)}. Enable profilingConfig and boot the sandbox first.")
+        return {}
+
+    durations = {}
+    failures = {}
+    skipped = {}
+    for run in runs:
+        for step in run['steps']:
+            name = step.get('name', '?')
+            if step.get('rc') == 'skipped':
+                skipped[name] = skipped.get(name, 0) + 1
+                continue
+            durations.setdefault(name, []).append(step['seconds'])
+            if step.get('rc') != '0':
+                failures[name] = failures.get(name, 0) + 1
+
+    report = {'runs': len(runs), 'tools': {}, 'criticalPath': [], 'boot': {}}
+    # A tool skipped on every boot never ran, so it is listed with no install time
+    names = set(durations) | set(failures) | set(skipped)
+    stats = {}
+    for name in names:
+        values = durations.get(name, [])
+        stats[name] = {
+            'runs': len(values),
+            'p50': _percentile(values, 50) if values else 0.0,
+            'p95': _percentile(values, 95) if values else 0.0,
+            'failed': failures.get(name, 0),
+            'skipped': skipped.get(name, 0),
+        }
+    for name in sorted(names, key=lambda name: (stats[name]['p50'], name), reverse=True):
+        report['tools'][name] = stats[name]
+
+    boot_times = [_elapsed_seconds(run['start'], run['end']) for run in runs if 'start' in run and 'end' in run]
+    if boot_times:
+        report['boot'] = {'p50': _percentile(boot_times, 50), 'p95': _percentile(boot_times, 95)}
+
+    # Levels wait for their slowest step, so the critical path is the slowest tool of each level
+    levels = {}
+    for step in runs[-1]['steps']:
+        name = step.get('name', '?')
+        if name in report['tools']:
+            levels.setdefault(int(step.get('level', 0)), []).append(name)
+    for level in sorted(levels):
+        slowest = max(levels[level], key=lambda name: report['tools'][name]['p50'])
+        report['criticalPath'].append({'level': level, 'tool': slowest, 'p50': report['tools'][slowest]['p50']})
+
+    if output == 'json':
+        print(json.dumps(report, indent=4))
+        return report
+    log_info(f"Boot report over {len(runs)} runs:", runs=len(runs))
+    log_info(f"{'Tool':<30}{'Runs':>6}{'p50 (s)':>10}{'p95 (s)':>10}{'Failed':>8}{'Skipped':>9}")
+    for name, stats in report['tools'].items():
+        log_info(f"{name:<30}{stats['runs']:>6}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['failed']:>8}{stats['skipped']:>9}",
+                 tool=name, **stats)
+    if report['boot']:
+        log_info(f"Logon to ready: p50 {report['boot']['p50']:.1f}s, p95 {report['boot']['p95']:.1f}s", **report['boot'])
+    total = sum(item['p50'] for item in report['criticalPath'])
+    path = ' -> '.join(f"{item['tool']} ({item['p50']:.1f}s)" for item in report['criticalPath'])
+    log_info(f"Critical path (p50, {total:.1f}s): {path}", seconds=total, criticalPath=report['criticalPath'])
+    return report
 
 def check_and_enable_dependencies(config: json, tool_name: str) -> json:
-    """Check and automatically enable dependencies for a tool."""
+    """Check and automatically enable the dependencies of a tool, including indirect ones."""
     tools = config.get('tools', {})
-    tool_info = tools.get(tool_name, {})
-    dependencies = tool_info.get('dependencies', [])
-    
-    if not dependencies:
+    graph = get_dependency_graph(config)
+    dependencies = get_all_dependencies(config, tool_name)
+    missing = [dep for name in [tool_name] + dependencies for dep in graph['missing'].get(name, [])]
+
+    if not dependencies and not missing:
         return config
-    
-    print(f"[*] Checking dependencies for {tool_name}...")
+
+    log_info(f"Checking dependencies for {tool_name}...")
     dependencies_enabled = []
-    
+
     for dep in dependencies:
-        if dep in tools:
-            if not tools[dep].get('enable', False):
-                tools[dep]['enable'] = True
-                dependencies_enabled.append(dep)
-                print(f"[+] Auto-enabled dependency: {dep}")
-            else:
-                print(f"[*] Dependency already enabled: {dep}")
+        if not tools[dep].get('enable', False):
+            tools[dep]['enable'] = True
+            mark_config_dirty('tools', dep)
+            dependencies_enabled.append(dep)
+            log_success(f"Auto-enabled dependency: {dep}")
         else:
-            print(f"[-] Warning: Dependency '{dep}' not found in available tools")
-    
+            log_info(f"Dependency already enabled: {dep}")
+    for dep in missing:
+        log_warning(f"Dependency '{dep}' not found in available tools")
+    if len(graph['component'].get(tool_name, ())) > 1:
+        log_warning(f"{tool_name} is part of a circular dependency: {', '.join(sorted(graph['component'][tool_name]))}")
+
     if dependencies_enabled:
-        save_config(config)
-        print(f"[+] Enabled {len(dependencies_enabled)} dependencies for {tool_name}")
+        log_success(f"Enabled {len(dependencies_enabled)} dependencies for {tool_name}")
     
     return config
 
-def get_all_dependencies(config: json, tool_name: str, visited=None) -> list:
-    """Get all dependencies for a tool recursively to avoid circular dependencies."""
-    if visited is None:
-        visited = set()
-    
-    if tool_name in visited:
-        return []  # Circular dependency detected
-    
-    visited.add(tool_name)
+def get_all_dependencies(config: json, tool_name: str) -> list:
+    """Get all dependencies of a tool, direct and indirect, in install order."""
+    graph = get_dependency_graph(config)
+    closure = graph['closure'].get(tool_name, frozenset())
+    return [name for name in graph['order'] if name in closure]
+
+
+def _parse_vm_setting(setting: str) -> tuple:
+    """Parse a KEY=VALUE vmConfig override, reading the value as JSON when possible."""
+    key, sep, value = setting.partition('=')
+    if not sep or not key:
+        raise ValueError(f"Invalid vmConfig override '{setting}', expected KEY=VALUE")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+def apply_overrides(config: dict, enable: list = (), disable: list = (), only: list = None, vm_settings: dict = None) -> dict:
+    """Apply tool and vmConfig overrides to a configuration in memory, enabling dependencies as needed."""
     tools = config.get('tools', {})
-    tool_info = tools.get(tool_name, {})
-    dependencies = tool_info.get('dependencies', [])
-    
-    all_deps = []
-    for dep in dependencies:
-        all_deps.append(dep)
-        # Recursively get dependencies of dependencies
-        sub_deps = get_all_dependencies(config, dep, visited.copy())
-        all_deps.extend(sub_deps)
-    
-    return list(set(all_deps))  # Remove duplicates
+    unknown = [name for name in list(enable) + list(disable) + list(only or []) if name not in tools]
+    if unknown:
+        raise ValueError(f"Unknown tools: {', '.join(unknown)}")
 
+    if only is not None:
+        for name, tool in tools.items():
+            tool['enable'] = name in only
+    for name in enable:
+        tools[name]['enable'] = True
+    for name in disable:
+        tools[name]['enable'] = False
+    for name in [name for name, tool in tools.items() if tool.get('enable', False)]:
+        for dep in get_all_dependencies(config, name):
+            if dep in tools and not tools[dep].get('enable', False):
+                tools[dep]['enable'] = True
+                log_success(f"Auto-enabled dependency {dep} for {name}")
 
-if __name__ == "__main__":
+    config.setdefault('vmConfig', {}).update(vm_settings or {})
+    return config
+
+def build_profiles(config: dict, profiles: dict, output_dir: str = None, download: bool = True) -> dict:
+    """Generate the .wsb and setup.cmd of several profiles in one pass.
+
+    profiles maps a profile name to its overrides ('enable', 'disable', 'only', 'vmConfig').
+    The installers of the union of all profiles are downloaded once, and tools whose installer
+    could not be downloaded are left out of the generated scripts. A profile named None
+    is written to the default WinSandbox.wsb and scripts/setup.cmd."""
+    profile_configs = {}
+    for name, overrides in profiles.items():
+        if name is not None and not re.fullmatch(r'[\w.-]+', name):
+            raise ValueError(f"Invalid profile name '{name}'")
+        profile_config = apply_overrides(
+            copy.deepcopy(config),
+            overrides.get('enable', []),
+            overrides.get('disable', []),
+            overrides.get('only'),
+            overrides.get('vmConfig', {}),
+        )
+        profile_configs[name] = profile_config
+
+    if download:
+        union = copy.deepcopy(config)
+        for tool_name, tool in union.get('tools', {}).items():
+            tool['enable'] = any(profile_config['tools'][tool_name].get('enable', False) for profile_config in profile_configs.values())
+        _report_downloads(download_missing_setup_files(union))
+        prepare_extracted_tools(union)
+        prepare_wheelhouses(union)
+        profile_configs = {name: exclude_unavailable_tools(profile_config) for name, profile_config in profile_configs.items()}
+
+    output_dir = output_dir or os.path.join(os.path.dirname(__file__), 'profiles')
+    for name, profile_config in profile_configs.items():
+        if name is None:
+            generate_setup_cmd(profile_config)
+            generate_wsb_config(profile_config)
+            continue
+        profile_dir = os.path.join(output_dir, name)
+        os.makedirs(profile_dir, exist_ok=True)
+        log_info(f"Building profile {name}...")
+        generate_setup_cmd(profile_config, output_path=os.path.join(profile_dir, 'setup.cmd'))
+        write_if_changed(os.path.join(profile_dir, 'start.cmd'), f'start "Setup Console" cmd.exe /k "{PROFILE_SANDBOX_FOLDER}\\setup.cmd"\n')
+        generate_wsb_config(profile_config, output_path=os.path.join(profile_dir, 'WinSandbox.wsb'), profile_dir=profile_dir)
+    return profile_configs
+
+def _run_build(args: argparse.Namespace):
+    """Run the non-interactive 'build' command."""
     config = get_config()
-    configure_sandbox()
-    generate_setup_cmd(config)
+    only = [name.strip() for name in args.only.split(',') if name.strip()] if args.only is not None else None
+    vm_settings = dict(_parse_vm_setting(setting) for setting in args.set)
+    apply_overrides(config, args.enable, args.disable, only, vm_settings)
+
+    if args.profiles:
+        with open(args.profiles, 'r') as file:
+            profiles = json.load(file).get('profiles', {})
+        if args.profile:
+            missing = [name for name in args.profile if name not in profiles]
+            if missing:
+                raise ValueError(f"Profiles not found in {args.profiles}: {', '.join(missing)}")
+            profiles = {name: profiles[name] for name in args.profile}
+    elif args.profile:
+        profiles = {name: {} for name in args.profile}
+    else:
+        profiles = {None: {}}
+    build_profiles(config, profiles, args.output_dir, download=not args.no_download)
+
+def main(argv: list = None):
+    """Parse the command line and run the requested command, the interactive configuration by default."""
+    global CONFIG_PATH
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', default=argparse.SUPPRESS, help="configuration file to use (default: config.json next to main.py)")
+    common.add_argument('-q', '--quiet', action='store_true', default=argparse.SUPPRESS, help="only show warnings and errors")
+    common.add_argument('-v', '--verbose', action='store_true', default=argparse.SUPPRESS, help="also show per-tool details")
+    common.add_argument('--log-format', choices=['text', 'json'], default=argparse.SUPPRESS, help="print messages as text or as one JSON object per line")
+
+    parser = argparse.ArgumentParser(description="Generate Windows Sandbox configurations with tools ready to go.", parents=[common])
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('configure', parents=[common], help="interactive configuration (default)")
+    build = subparsers.add_parser('build', parents=[common], help="non-interactive build of one or more profiles")
+    build.add_argument('--enable', action='append', default=[], metavar='TOOL', help="enable a tool (repeatable)")
+    build.add_argument('--disable', action='append', default=[], metavar='TOOL', help="disable a tool (repeatable)")
+    build.add_argument('--only', metavar='TOOL,TOOL', help="enable exactly these tools (and their dependencies)")
+    build.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help="override a vmConfig value (repeatable)")
+    build.add_argument('--profiles', metavar='FILE', help="JSON file with named profiles to build")
+    build.add_argument('--profile', action='append', default=[], metavar='NAME', help="build only this profile, or a profile with this name from the flags above (repeatable)")
+    build.add_argument('--output-dir', help="folder the named profiles are written to (default: profiles)")
+    build.add_argument('--no-download', action='store_true', help="only generate the files, do not download installers")
+    subparsers.add_parser('update', parents=[common], help="re-download installers that changed upstream")
+    subparsers.add_parser('boot-report', parents=[common], help="report install times from the boot logs")
+    serve = subparsers.add_parser('serve-cache', parents=[common], help="serve the installer cache over HTTP as a mirror for other hosts")
+    serve.add_argument('--bind', default='', metavar='ADDRESS', help="address to listen on (default: all interfaces)")
+    serve.add_argument('--port', type=int, default=SERVE_CACHE_PORT, help=f"port to listen on (default: {SERVE_CACHE_PORT})")
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'config', None):
+        CONFIG_PATH = os.path.abspath(args.config)
+    log_format = getattr(args, 'log_format', 'text')
+    configure_logging(getattr(args, 'quiet', False), getattr(args, 'verbose', False), log_format == 'json')
+
+    try:
+        if args.command == 'build':
+            _run_build(args)
+        elif args.command == 'update':
+            update_setup_files(get_config())
+        elif args.command == 'boot-report':
+            boot_report(get_config(), log_format)
+        elif args.command == 'serve-cache':
+            serve_cache(get_config(), args.bind, args.port)
+        else:
+            configure_sandbox()
+    except (ValueError, OSError) as e:
+        log_error(str(e))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        log_warning("Interrupted.")
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
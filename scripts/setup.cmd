@@ -1,24 +1,113 @@
 @echo off
+rem sandbox-auto-setup fingerprint 79158786370b176bf9c08fce13d430df98cb4115140f963d908a5dacca06879d
+rem Background install steps re-enter this script with the label to run
+if not "%~1"=="" goto %~1
 set SETUP_PATH=C:\users\WDAGUtilityAccount\Desktop\scripts\setups
-echo [*] Copying setup files...
-copy /B /Y /V %SETUP_PATH%\* %TEMP%\
+set "STATUS_DIR=%TEMP%\sandbox-setup"
+if exist "%STATUS_DIR%" rmdir /s /q "%STATUS_DIR%"
+mkdir "%STATUS_DIR%"
 
-msiexec /i "%TEMP%\7z2409-x64.msi" /qn /norestart
-echo [*] Installing Visual Studio Code...
-"%TEMP%\vscodesetup-x64.exe" /verysilent /suppressmsgboxes /MERGETASKS="!runcode,addtopath"
-
-echo [*] Installing Python 3...
-"%TEMP%\python-3.12.4-amd64.exe" /quiet InstallAllUsers=1 PrependPath=1 Include_test=0
+echo [*] Installing level 1: 7-Zip, Visual Studio Code, Python 3...
+start "7-Zip" /b cmd /c call "%~f0" :step_1 >"%STATUS_DIR%\step_1.log" 2>&1
+start "Visual Studio Code" /b cmd /c call "%~f0" :step_2 >"%STATUS_DIR%\step_2.log" 2>&1
+start "Python 3" /b cmd /c call "%~f0" :step_3 >"%STATUS_DIR%\step_3.log" 2>&1
+call :wait_for step_1 step_2 step_3
 set "PATH=%PATH%;C:\Program Files\Python312\Scripts\"
 set "PATH=%PATH%;C:\Program Files\Python312\"
 
-echo [*] Installing Oletools...
-pip install -U oletools[full]
-echo "[*] oletools installed successfully."
+echo [*] Installing level 2: Oletools...
+set "STEP_BLOCKED="
+if exist "%STATUS_DIR%\step_3.failed" set "STEP_BLOCKED=1"
+if defined STEP_BLOCKED (call :skip_step step_4 "Oletools" 2) else start "Oletools" /b cmd /c call "%~f0" :step_4 >"%STATUS_DIR%\step_4.log" 2>&1
+call :wait_for step_4
 
 echo [*] Enabling PowerShell ScriptBlockLogging...
 powershell.exe -Command "New-Item -Path HKLM:\SOFTWARE\Wow6432Node\Policies\Microsoft\Windows\PowerShell\ScriptBlockLogging -Force"
 powershell.exe -Command "Set-ItemProperty -Path HKLM:\SOFTWARE\Wow6432Node\Policies\Microsoft\Windows\PowerShell\ScriptBlockLogging -Name EnableScriptBlockLogging -Value 1 -Force"
 
+if exist "%STATUS_DIR%\step_1.failed" echo [-] 7-Zip failed, see "%STATUS_DIR%\step_1.log"
+if exist "%STATUS_DIR%\step_2.failed" echo [-] Visual Studio Code failed, see "%STATUS_DIR%\step_2.log"
+if exist "%STATUS_DIR%\step_3.failed" echo [-] Python 3 failed, see "%STATUS_DIR%\step_3.log"
+if exist "%STATUS_DIR%\step_4.failed" echo [-] Oletools failed, see "%STATUS_DIR%\step_4.log"
 echo [*] All tasks completed.
-pause
\ No newline at end of file
+pause
+exit /b 0
+
+:wait_for
+if "%~1"=="" exit /b 0
+if not exist "%STATUS_DIR%\%~1.done" (
+    timeout /t 1 /nobreak >nul
+    goto wait_for
+)
+shift
+goto wait_for
+
+:skip_step
+echo [-] Skipping %~2, a prerequisite failed.
+>"%STATUS_DIR%\%~1.failed" echo skipped
+>"%STATUS_DIR%\%~1.done" echo done
+exit /b 0
+
+:step_1
+set "STEP_TRY=0"
+:step_1_run
+set "STEP_RC=0"
+msiexec /i "%SETUP_PATH%\7z2409-x64.msi" /qn /norestart || call set "STEP_RC=%%ERRORLEVEL%%"
+if not "%STEP_RC%"=="1618" goto step_1_end
+set /a STEP_TRY+=1
+if %STEP_TRY% GEQ 60 goto step_1_end
+echo [*] Another installation is in progress, retrying...
+timeout /t 5 /nobreak >nul
+goto step_1_run
+:step_1_end
+if "%STEP_RC%"=="0" (>"%STATUS_DIR%\step_1.ok" echo 0) else (>"%STATUS_DIR%\step_1.failed" echo %STEP_RC%)
+>"%STATUS_DIR%\step_1.done" echo done
+exit /b %STEP_RC%
+
+:step_2
+set "STEP_TRY=0"
+:step_2_run
+set "STEP_RC=0"
+"%SETUP_PATH%\VsCodeSetup-x64.exe" /verysilent /suppressmsgboxes /MERGETASKS="!runcode,addtopath" || call set "STEP_RC=%%ERRORLEVEL%%"
+if not "%STEP_RC%"=="1618" goto step_2_end
+set /a STEP_TRY+=1
+if %STEP_TRY% GEQ 60 goto step_2_end
+echo [*] Another installation is in progress, retrying...
+timeout /t 5 /nobreak >nul
+goto step_2_run
+:step_2_end
+if "%STEP_RC%"=="0" (>"%STATUS_DIR%\step_2.ok" echo 0) else (>"%STATUS_DIR%\step_2.failed" echo %STEP_RC%)
+>"%STATUS_DIR%\step_2.done" echo done
+exit /b %STEP_RC%
+
+:step_3
+set "STEP_TRY=0"
+:step_3_run
+set "STEP_RC=0"
+"%SETUP_PATH%\python-3.12.4-amd64.exe" /quiet InstallAllUsers=1 PrependPath=1 Include_test=0 || call set "STEP_RC=%%ERRORLEVEL%%"
+if not "%STEP_RC%"=="1618" goto step_3_end
+set /a STEP_TRY+=1
+if %STEP_TRY% GEQ 60 goto step_3_end
+echo [*] Another installation is in progress, retrying...
+timeout /t 5 /nobreak >nul
+goto step_3_run
+:step_3_end
+if "%STEP_RC%"=="0" (>"%STATUS_DIR%\step_3.ok" echo 0) else (>"%STATUS_DIR%\step_3.failed" echo %STEP_RC%)
+>"%STATUS_DIR%\step_3.done" echo done
+exit /b %STEP_RC%
+
+:step_4
+set "STEP_TRY=0"
+:step_4_run
+set "STEP_RC=0"
+pip install -U oletools[full] || call set "STEP_RC=%%ERRORLEVEL%%"
+if not "%STEP_RC%"=="1618" goto step_4_end
+set /a STEP_TRY+=1
+if %STEP_TRY% GEQ 60 goto step_4_end
+echo [*] Another installation is in progress, retrying...
+timeout /t 5 /nobreak >nul
+goto step_4_run
+:step_4_end
+if "%STEP_RC%"=="0" (>"%STATUS_DIR%\step_4.ok" echo 0) else (>"%STATUS_DIR%\step_4.failed" echo %STEP_RC%)
+>"%STATUS_DIR%\step_4.done" echo done
+exit /b %STEP_RC%